@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+import gzip
+import queue
+import threading
+
+# Open a text file for reading or writing, gzipped if it ends in .gz
+def open_text(filename, mode="r"):
+    if filename.endswith(".gz"):
+        return gzip.open(filename, mode+"t", compresslevel=6) if mode == "w" else gzip.open(filename, mode+"t")
+    return open(filename, mode)
+
+class BackgroundReader(object):
+
+    # Reads items from an iterator in a background thread, in chunks of
+    # chunk_size, keeping up to max_chunks ready ahead of the reader
+    def __init__(self, items, chunk_size=1000, max_chunks=16):
+        self.items = items
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(maxsize=max_chunks)
+        self.thread = threading.Thread(target=self.read, daemon=True)
+        self.thread.start()
+
+    # Put the chunks on the queue, followed by None at the end or the
+    # exception if reading failed
+    def read(self):
+        try:
+            chunk = []
+            for item in self.items:
+                chunk.append(item)
+                if len(chunk) == self.chunk_size:
+                    self.queue.put(chunk)
+                    chunk = []
+            if chunk:
+                self.queue.put(chunk)
+            self.queue.put(None)
+        except Exception as e:
+            self.queue.put(e)
+
+    def __iter__(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield from chunk
+
+class BackgroundWriter(object):
+
+    # Writes strings to out in a background thread, joining them into blocks
+    # of at least block_size characters. Up to max_blocks are kept waiting
+    # to be written
+    def __init__(self, out, block_size=1<<20, max_blocks=16):
+        self.out = out
+        self.block_size = block_size
+        self.buffer = []
+        self.buffer_size = 0
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_blocks)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Write the blocks until None is put on the queue
+    def run(self):
+        while True:
+            block = self.queue.get()
+            if block is None:
+                return
+            if self.error is None:
+                try:
+                    self.out.write(block)
+                except Exception as e:
+                    self.error = e
+
+    # Raise the error from the writing thread, if any
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    # Add a string to write
+    def write(self, string):
+        self.buffer.append(string)
+        self.buffer_size += len(string)
+        if self.buffer_size >= self.block_size:
+            self.flush()
+
+    # Send the buffered strings to the writing thread
+    def flush(self):
+        self.check()
+        if self.buffer:
+            self.queue.put("".join(self.buffer))
+            self.buffer = []
+            self.buffer_size = 0
+
+    # Write everything and wait for the writing thread to finish. The
+    # output is flushed but not closed
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        self.check()
+        self.out.flush()
@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+
+import random
+
+class CorpusGenerator(object):
+
+    # Generates a synthetic multi-parallel corpus with alignments, for
+    # benchmarking. The same seed and parameters always give the same corpus
+    #  density: the average number of target words each aligned word links to
+    #  null_rate: the probability that a source word is not aligned
+    def __init__(self, seed=0, min_len=5, max_len=30, num_trgs=1, density=1.5, null_rate=0.1, vocab_size=1000):
+        # Parameters
+        self.min_len = min_len
+        self.max_len = max_len
+        self.num_trgs = num_trgs
+        self.density = density
+        self.null_rate = null_rate
+        self.vocab_size = vocab_size
+        self.rand = random.Random(seed)
+
+    # Create the words of a sentence in a language
+    def create_words(self, lang, length):
+        return ["%s%d" % (lang, self.rand.randrange(self.vocab_size)) for i in range(length)]
+
+    # Create an alignment that stays near the diagonal
+    def create_align(self, src_len, trg_len):
+        align = set()
+        for i in range(src_len):
+            if self.rand.random() < self.null_rate:
+                continue
+            center = i * trg_len // src_len
+            # Link to at least one word, and more with probability density-1
+            num_links = 1 + int(self.density - 1) + (1 if self.rand.random() < (self.density - 1) % 1 else 0)
+            for k in range(num_links):
+                j = min(max(center + self.rand.randint(-1, 1), 0), trg_len-1)
+                align.add((i, j))
+        return sorted(align)
+
+    # Create one tuple of lines: src, trg1, align1, trg2, align2, ...
+    def create_lines(self):
+        src_len = self.rand.randint(self.min_len, self.max_len)
+        strs = [" ".join(self.create_words("s", src_len))]
+        for t in range(self.num_trgs):
+            trg_len = max(1, src_len + self.rand.randint(-src_len//4, src_len//4))
+            strs.append(" ".join(self.create_words("t%d_" % t, trg_len)))
+            strs.append(" ".join(["%d-%d" % x for x in self.create_align(src_len, trg_len)]))
+        return strs
+
+    # Create a corpus of num_sents tuples of lines
+    def create_corpus(self, num_sents):
+        return [self.create_lines() for i in range(num_sents)]
+
+    # Write a corpus to prefix.src, prefix.trg0, prefix.align0, ... and
+    # return the filenames in the order multi-extract.py takes them
+    def write_corpus(self, corpus, prefix):
+        filenames = ["%s.src" % prefix]
+        for t in range(self.num_trgs):
+            filenames += ["%s.trg%d" % (prefix, t), "%s.align%d" % (prefix, t)]
+        for i, filename in enumerate(filenames):
+            with open(filename, "w") as out:
+                for strs in corpus:
+                    print(strs[i], file=out)
+        return filenames
@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import accumulate
+
+class DocLines(object):
+
+    # The lines of a document, stored as its text and the offset of the start
+    # of each line. Lines are stripped when they are accessed, and can be
+    # indexed and sliced like the list of stripped lines
+    def __init__(self, text):
+        self.text = text
+        lines = text.split("\n")
+        # Like readlines, there is no empty line after a final newline
+        if lines[-1] == "":
+            lines.pop()
+        self.offsets = array("Q", [0])
+        self.offsets.extend(accumulate([len(x)+1 for x in lines]))
+
+    def __len__(self):
+        return len(self.offsets)-1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self.get_line(x) for x in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError("line index out of range")
+        return self.get_line(idx)
+
+    # Get a single line by its non-negative index
+    def get_line(self, idx):
+        return self.text[self.offsets[idx]:self.offsets[idx+1]].strip()
+
+class DocReader(object):
+
+    # Reads the lines of documents, keeping the most recently used max_docs
+    # documents. If threads is more than 0, documents can be prefetched in
+    # the background before they are needed
+    def __init__(self, max_docs=100, threads=0):
+        # Parameters
+        self.max_docs = max_docs
+        self.executor = ThreadPoolExecutor(max_workers=threads) if threads > 0 else None
+        # The documents, or futures of the documents being prefetched
+        self.docs = OrderedDict()
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+
+    # Read a document
+    def load(self, filename):
+        with open(filename, "r") as txt_file:
+            return DocLines(txt_file.read())
+
+    # Add a document or future, evicting the least recently used ones
+    def put(self, filename, doc):
+        self.docs[filename] = doc
+        while len(self.docs) > self.max_docs:
+            self.docs.popitem(last=False)
+
+    # Start reading a document in the background if it isn't cached
+    def prefetch(self, filename):
+        if self.executor is not None and filename not in self.docs:
+            self.put(filename, self.executor.submit(self.load, filename))
+
+    # Get the lines of a document
+    def get(self, filename):
+        doc = self.docs.get(filename)
+        if doc is None:
+            self.misses += 1
+            doc = self.load(filename)
+            self.put(filename, doc)
+        else:
+            self.hits += 1
+            self.docs.move_to_end(filename)
+            if isinstance(doc, Future):
+                doc = self.docs[filename] = doc.result()
+        return doc
+
+    # Stop the prefetching threads
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+
+import heapq
+import json
+
+class ExtractStats(object):
+
+    # Statistics of rule extraction: the time spent in each stage, counts of
+    # the spans, phrases and rules at each step, and the top_k slowest
+    # sentences with their line numbers
+    def __init__(self, top_k=10):
+        # Parameters
+        self.top_k = top_k
+        # The totals
+        self.sents = 0
+        self.times = dict(parse=0.0, phrases=0.0, nulls=0.0, abstract=0.0, render=0.0)
+        self.counts = dict(candidate_spans=0, consistent_phrases=0, null_phrases=0, hole_combinations=0, filtered_rules=0, rules=0, cached_sents=0, degraded_sents=0, skipped_sents=0)
+        # A min-heap of (time, line number) of the slowest sentences
+        self.slowest = []
+
+    # Add the total time of a sentence
+    def add_sentence(self, lineno, elapsed):
+        self.sents += 1
+        self.add_slowest(lineno, elapsed)
+
+    # Keep a sentence if it is one of the top_k slowest
+    def add_slowest(self, lineno, elapsed):
+        if len(self.slowest) < self.top_k:
+            heapq.heappush(self.slowest, (elapsed, lineno))
+        elif self.slowest and elapsed > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (elapsed, lineno))
+
+    # Add the statistics of another object, such as one from a worker
+    def merge(self, other):
+        self.sents += other.sents
+        for k, v in other.times.items():
+            self.times[k] += v
+        for k, v in other.counts.items():
+            self.counts[k] += v
+        for elapsed, lineno in other.slowest:
+            self.add_slowest(lineno, elapsed)
+
+    # Get the statistics as a dictionary
+    def to_dict(self):
+        return {"sentences": self.sents,
+                "times": self.times,
+                "counts": self.counts,
+                "slowest": [{"line": lineno, "time": elapsed} for elapsed, lineno in sorted(self.slowest, reverse=True)]}
+
+    # Write the statistics as JSON
+    def write(self, filename):
+        with open(filename, "w") as out:
+            json.dump(self.to_dict(), out, indent=2)
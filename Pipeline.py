@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+class Stage(object):
+
+    # A stage of the pipeline. cmd is either a shell command or a python
+    # function taking no arguments. The stage is re-run when the command,
+    # params, or any of the inputs change, or an output is missing
+    def __init__(self, name, cmd, inputs=(), outputs=(), deps=(), params=None):
+        self.name = name
+        self.cmd = cmd
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+        self.params = params
+
+class Pipeline(object):
+
+    # Runs the stages in dependency order, with up to threads of them at
+    # once. Completed stages are recorded in stamp_dir and skipped on reruns
+    def __init__(self, stamp_dir, threads=1, log=sys.stderr):
+        self.stamp_dir = stamp_dir
+        self.threads = threads
+        self.log = log
+        self.stages = OrderedDict()
+        # The wall time and peak RSS of each stage. The peak RSS of a python
+        # function stage is None, as it runs in this process
+        self.stats = OrderedDict()
+
+    # Add a stage
+    def add(self, stage):
+        if stage.name in self.stages:
+            raise Exception("Duplicate stage %s" % stage.name)
+        for dep in stage.deps:
+            if dep not in self.stages:
+                raise Exception("Stage %s depends on unknown stage %s" % (stage.name, dep))
+        self.stages[stage.name] = stage
+
+    # Hash the command, parameters and inputs of a stage. Inputs are
+    # identified by their size and modification time
+    def stage_hash(self, stage):
+        key = hashlib.sha1()
+        cmd = stage.cmd if isinstance(stage.cmd, str) else stage.cmd.__name__
+        key.update(("%s\n%r\n" % (cmd, stage.params)).encode("utf-8"))
+        for filename in stage.inputs:
+            stat = os.stat(filename)
+            key.update(("%s %d %d\n" % (filename, stat.st_size, stat.st_mtime_ns)).encode("utf-8"))
+        return key.hexdigest()
+
+    # Get the stamp file of a stage
+    def stamp_file(self, stage):
+        return os.path.join(self.stamp_dir, stage.name+".done")
+
+    # Return the recorded statistics if the stage was completed with the
+    # same hash, or None if it was not
+    def read_stamp(self, stage, stage_hash):
+        if not all([os.path.exists(x) for x in stage.outputs]):
+            return None
+        try:
+            with open(self.stamp_file(stage), "r") as stamp:
+                stats = json.load(stamp)
+        except (IOError, ValueError):
+            return None
+        return stats if stats.get("hash") == stage_hash else None
+
+    # Run a single stage, returning its wall time and peak RSS in KB, or
+    # None for python functions. Those run in a thread of this process, whose
+    # peak RSS covers everything it has done so far, not only the stage
+    def run_stage(self, stage):
+        start = time.time()
+        if isinstance(stage.cmd, str):
+            print("Executing: %s" % stage.cmd, file=self.log)
+            proc = subprocess.Popen(["bash", "-o", "pipefail", "-c", stage.cmd])
+            # Wait with wait4 to get the peak RSS of the command and its children
+            _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            if proc.returncode != 0:
+                raise Exception("Stage %s failed with exit code %d: %s" % (stage.name, proc.returncode, stage.cmd))
+            max_rss = usage.ru_maxrss
+        else:
+            stage.cmd()
+            max_rss = None
+        return time.time()-start, max_rss
+
+    # Check whether a stage needs to be run, and run it if it does
+    def process_stage(self, stage):
+        stage_hash = self.stage_hash(stage)
+        stats = self.read_stamp(stage, stage_hash)
+        if stats is not None:
+            print("Skipping completed stage %s" % stage.name, file=self.log)
+            stats["status"] = "skipped"
+            self.stats[stage.name] = stats
+            return
+        if os.path.exists(self.stamp_file(stage)):
+            os.remove(self.stamp_file(stage))
+        wall_time, max_rss = self.run_stage(stage)
+        stats = {"hash": stage_hash, "wall_time": wall_time, "max_rss_kb": max_rss}
+        with open(self.stamp_file(stage), "w") as stamp:
+            json.dump(stats, stamp)
+        stats["status"] = "run"
+        self.stats[stage.name] = stats
+        print("Finished stage %s in %.1f sec (peak RSS %s)" % (stage.name, wall_time, "%d KB" % max_rss if max_rss is not None else "n/a"), file=self.log)
+
+    # Run all the stages
+    def run(self):
+        os.makedirs(self.stamp_dir, exist_ok=True)
+        done = set()
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=max(self.threads, 1)) as executor:
+            while len(done) < len(self.stages):
+                # Start every stage whose dependencies are done
+                if error is None:
+                    for name, stage in self.stages.items():
+                        if name not in done and name not in running.values() and all([x in done for x in stage.deps]):
+                            running[executor.submit(self.process_stage, stage)] = name
+                if not running:
+                    break
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                    else:
+                        done.add(name)
+        if error is not None:
+            raise error
+
+    # Write the stage statistics as JSON. Skipped stages have the statistics
+    # of the run that completed them
+    def write_stats(self, filename):
+        with open(filename, "w") as stats_file:
+            json.dump(self.stats, stats_file, indent=2)
@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+
+import gzip
+import heapq
+import os
+import shutil
+import sys
+import tempfile
+
+class RuleAggregator(object):
+
+    def __init__(self, max_mem=1024, tmpdir=None, max_runs=64):
+        # Parameters (max_mem is the memory budget in MB, max_runs the
+        # number of runs to merge at once)
+        self.max_bytes = max_mem * 1024 * 1024
+        self.tmpdir = tmpdir
+        self.max_runs = max_runs
+        # The table of counts, keyed on everything before the count
+        self.counts = {}
+        self.num_bytes = 0
+        # The sorted runs that have been spilled to disk, and those added
+        # with add_run, which are not removed
+        self.runs = []
+        self.kept_runs = set()
+        # The directory the runs are spilled to, created on the first spill
+        # and removed with everything in it by close
+        self.run_dir = None
+        # Constants
+        self.entry_bytes = 100
+
+    # Add a rule string "src ||| trg ||| count" to the table
+    def add(self, rule_str):
+        split = rule_str.rindex(" ||| ") + 5
+        self.add_count(rule_str[:split], float(rule_str[split:]))
+
+    # Add a count for a rule, where key is "src ||| trg ||| "
+    def add_count(self, key, count):
+        if key in self.counts:
+            self.counts[key] += count
+        else:
+            self.counts[key] = count
+            self.num_bytes += sys.getsizeof(key) + self.entry_bytes
+            if self.num_bytes > self.max_bytes:
+                self.spill()
+
+    # Write the current table to disk as a sorted run and clear it
+    def spill(self):
+        if not self.counts:
+            return
+        self.runs.append(self.write_run((key, self.counts[key]) for key in sorted(self.counts)))
+        self.counts = {}
+        self.num_bytes = 0
+
+    # Write sorted (key, count) pairs to a temporary file and return its name
+    def write_run(self, items):
+        if self.run_dir is None:
+            self.run_dir = tempfile.mkdtemp(prefix="rule-agg.", dir=self.tmpdir)
+        fd, filename = tempfile.mkstemp(suffix=".txt", dir=self.run_dir)
+        with os.fdopen(fd, "w") as run_file:
+            for key, count in items:
+                run_file.write("%s%r\n" % (key, count))
+        return filename
+
+    # Add an existing sorted run, such as one written by write, to merge
+    # with the counts
+    def add_run(self, filename):
+        self.runs.append(filename)
+        self.kept_runs.add(filename)
+
+    # Read the (key, count) pairs of a sorted run, which may be gzipped
+    def read_run(self, filename):
+        with (gzip.open(filename, "rt") if filename.endswith(".gz") else open(filename, "r")) as run_file:
+            for line in run_file:
+                split = line.rindex(" ||| ") + 5
+                yield line[:split], float(line[split:])
+
+    # Merge sorted runs, summing the counts of identical keys
+    def merge_runs(self, runs):
+        prev_key, prev_count = None, 0.0
+        for key, count in heapq.merge(*[self.read_run(x) for x in runs]):
+            if key == prev_key:
+                prev_count += count
+            else:
+                if prev_key is not None:
+                    yield prev_key, prev_count
+                prev_key, prev_count = key, count
+        if prev_key is not None:
+            yield prev_key, prev_count
+
+    # Iterate over the sorted, deduplicated (key, count) pairs. Keys end in
+    # " ||| " so this is the same order as LC_ALL=C sort on the output lines
+    def items(self):
+        if not self.runs:
+            for key in sorted(self.counts):
+                yield key, self.counts[key]
+            return
+        self.spill()
+        # Merge in several passes if there are too many runs to open at once
+        while len(self.runs) > self.max_runs:
+            runs, self.runs = self.runs[:self.max_runs], self.runs[self.max_runs:]
+            self.runs.append(self.write_run(self.merge_runs(runs)))
+            for filename in runs:
+                if filename not in self.kept_runs:
+                    os.remove(filename)
+        for key, count in self.merge_runs(self.runs):
+            yield key, count
+
+    # Write the aggregated rules in the same format as create_rule_string.
+    # If run_out is given, also write the exact counts to it as a sorted run
+    def write(self, out, run_out=None):
+        for key, count in self.items():
+            out.write("%s%f\n" % (key, count))
+            if run_out is not None:
+                run_out.write("%s%r\n" % (key, count))
+
+    # Remove the spilled runs from disk. This is safe to call more than once
+    def close(self):
+        if self.run_dir is not None:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+            self.run_dir = None
+        self.runs = []
+        self.kept_runs = set()
+        self.counts = {}
+        self.num_bytes = 0
@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+
+from collections import OrderedDict
+import hashlib
+
+class RuleCache(object):
+
+    # A least-recently-used cache of the rule strings extracted from each
+    # sentence tuple, for corpora where the same sentences are repeated.
+    # Sentences with more than max_sent_rules rules are not cached, as long
+    # sentences are rarely repeated and would push out many short ones
+    def __init__(self, max_sents=10000, max_rules=500000, max_sent_rules=2000):
+        # Parameters
+        self.max_sents = max_sents
+        self.max_rules = max_rules
+        self.max_sent_rules = max_sent_rules
+        # The cached rule lists and the total number of rules in them
+        self.entries = OrderedDict()
+        self.num_rules = 0
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+
+    # Make a key from the parsed words and alignments. The alignments are
+    # sorted and deduplicated, as their order doesn't change the rules
+    def make_key(self, words, aligns):
+        key = hashlib.blake2b(digest_size=16)
+        for x in words:
+            key.update((' '.join(x)+'\n').encode('utf-8'))
+        for x in aligns:
+            key.update((' '.join(["%d-%d" % y for y in sorted(set(x))])+'\n').encode('utf-8'))
+        return key.digest()
+
+    # Get the rules for a key, or None if they are not cached
+    def get(self, key):
+        rules = self.entries.get(key)
+        if rules is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return rules
+
+    # Add the rules for a key, evicting the least recently used entries
+    def put(self, key, rules):
+        if len(rules) > min(self.max_rules, self.max_sent_rules) or self.max_sents <= 0:
+            return
+        self.entries[key] = rules
+        self.num_rules += len(rules)
+        while len(self.entries) > self.max_sents or self.num_rules > self.max_rules:
+            self.num_rules -= len(self.entries.popitem(last=False)[1])
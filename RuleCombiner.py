@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+
+import heapq
+import re
+
+class RuleCombiner(object):
+
+    # Combines the src-trg and trg-src tables of the whole rule and each
+    # target factor into a single multi-target table, keeping the top
+    # limit rules for each src. Types of limits:
+    #  egfp: Simply the top scoring src->trg0/trg1/... pairs
+    #  0egfp: Choose the top scoring trg0s, and the single best remainder
+    def __init__(self, limit=20, limit_type="egfp"):
+        if limit_type not in ("egfp", "0egfp"):
+            raise Exception("Unknown limit type %s" % limit_type)
+        # Parameters
+        self.limit = limit
+        self.limit_type = limit_type
+        # Features that are not used in the combined table
+        self.feat_filter = re.compile(r"^(w=|\d+p=|\d*lfreq)")
+
+    # Read a sorted table, yielding (src, [(trg, feats), ...]) for each src
+    def iter_src_groups(self, table):
+        prev_src, trgs = None, []
+        for line in table:
+            src, trg, feats = line.rstrip("\n").split(" ||| ")
+            if src != prev_src:
+                if prev_src is not None:
+                    yield prev_src, trgs
+                prev_src, trgs = src, []
+            trgs.append((trg, feats))
+        if prev_src is not None:
+            yield prev_src, trgs
+
+    # Merge the src groups of all tables, yielding (src, [group_or_None, ...])
+    # for each src in the first table. Groups are ordered like LC_ALL=C sort
+    # on the lines, so compare srcs with the following " ||| "
+    def iter_merged_groups(self, tables):
+        iters = [self.iter_src_groups(x) for x in tables]
+        heads = [next(x, None) for x in iters]
+        while heads[0] is not None:
+            src = heads[0][0]
+            key = src+" ||| "
+            groups = []
+            for i, head in enumerate(heads):
+                # Skip srcs that are not in the first table
+                while head is not None and head[0]+" ||| " < key:
+                    head = heads[i] = next(iters[i], None)
+                if head is not None and head[0] == src:
+                    groups.append(head[1])
+                    heads[i] = next(iters[i], None)
+                else:
+                    groups.append(None)
+            yield src, groups
+
+    # Combine the groups for one src and return the top output lines
+    def combine_group(self, src, groups):
+        # Index the rules of the first table by the target column: column 0
+        # is the whole target and column k+1 is target factor k
+        out = [[trg, [feats]] for trg, feats in groups[0]]
+        idx = [{}]
+        for i, (trg, feats) in enumerate(groups[0]):
+            idx[0].setdefault(trg, []).append(i)
+            for col, col_trg in enumerate(trg.split(" |COL| "), 1):
+                while len(idx) <= col:
+                    idx.append({})
+                idx[col].setdefault(col_trg, []).append(i)
+        # Add the features of the other tables, two for each column
+        for table in range(1, len(groups)):
+            if groups[table] is None:
+                continue
+            col_idx = idx[table//2] if table//2 < len(idx) else {}
+            for trg, feats in groups[table]:
+                for i in col_idx.get(trg, ()):
+                    out[i][1].append(feats)
+        # Filter the features and find the trimming score
+        cands = []
+        best = {}
+        for trg, feats in out:
+            feats = [x for x in " ".join(feats).split(" ") if not self.feat_filter.match(x)]
+            line = "%s ||| %s ||| %s" % (src, trg, " ".join(feats))
+            egfp = self.get_feat(feats, "egfp", line)
+            if self.limit_type == "egfp":
+                cands.append((egfp, line))
+            else:
+                first_trg = trg.split(" |COL| ")[0]
+                if first_trg not in best or egfp > best[first_trg][2]:
+                    best[first_trg] = (self.get_feat(feats, "0egfp", line), line, egfp)
+        if self.limit_type == "0egfp":
+            cands = [x[:2] for x in best.values()]
+        # Take the top n with a bounded heap
+        return [x[1] for x in heapq.nlargest(self.limit, cands, key=lambda x: x[0])]
+
+    # Get the value of a feature
+    def get_feat(self, feats, name, line):
+        name = name+"="
+        for feat in feats:
+            if feat.startswith(name):
+                return float(feat[len(name):])
+        raise Exception("No %s probability in %s" % (name[:-1], line))
+
+    # Combine the tables and write the output
+    def combine(self, tables, out):
+        for src, groups in self.iter_merged_groups(tables):
+            for line in self.combine_group(src, groups):
+                out.write(line+"\n")
@@ -1,12 +1,18 @@
 #!/usr/bin/python3
 
 from collections import defaultdict
-import re
 import itertools
+import sys
+import time
+
+import RuleRenderer
+
+class BudgetExceeded(Exception):
+    pass
 
 class RuleExtractor(object):
 
-    def __init__(self, max_sym_src=5, max_sym_trg=999, num_trgs=1, max_nonterm=2, min_src_interceding=1, max_span=15):
+    def __init__(self, max_sym_src=5, max_sym_trg=999, num_trgs=1, max_nonterm=2, min_src_interceding=1, max_span=15, norm_kept=False, src_filter=None, stats=None, max_phrases=0, max_rules=0, max_time=0, budget_action="degrade", log=sys.stderr):
         # Parameters
         self.max_sym_src = max_sym_src
         self.max_sym_trg = max_sym_trg
@@ -14,118 +20,243 @@ class RuleExtractor(object):
         self.max_nonterm = max_nonterm
         self.min_src_interceding = min_src_interceding
         self.max_span = max_span
+        # If true, divide the count of each phrase over only the rules that
+        # pass the symbol limits, not all rules enumerated from it
+        self.norm_kept = norm_kept
+        # If a SrcFilter is given, only extract rules whose src terminals
+        # are all in it
+        self.src_filter = src_filter
+        # If an ExtractStats is given, time each stage and count the phrases
+        # and rules of each sentence in it
+        self.stats = stats
+        # Per-sentence budgets on the number of phrases with nulls added, the
+        # number of enumerated rules and the time in seconds (0 for none).
+        # Sentences over the phrase or rule budgets either skip extraction or
+        # degrade by not adding nulls or lowering max_nonterm, depending on
+        # budget_action. Sentences over the time budget are always skipped.
+        # Each one is reported to log
+        self.max_phrases = max_phrases
+        self.max_rules = max_rules
+        self.max_time = max_time
+        if budget_action not in ("degrade", "skip"):
+            raise Exception("Unknown budget action %s" % budget_action)
+        self.budget_action = budget_action
+        self.budgets = max_phrases > 0 or max_rules > 0 or max_time > 0
+        self.log = log
+        # The time the budget of the current sentence runs out, or None if
+        # there is no time budget or no sentence being extracted
+        self.deadline = None
         # Constants
         self.max_len = 999999
         self.max_sym = ((self.max_sym_src,) + (self.max_sym_trg,)*num_trgs)
 
-    # Parsing functions
+    # Parsing functions. Words are split on spaces only
     def parse_words(self, x):
-        return re.findall(r"[^ ]+", x)
+        return [y for y in x.split(" ") if y]
     def parse_align(self, x):
+        pairs = x.split()
+        # If every pair is a plain i-j, convert all the numbers at once
+        if x.count("-") == len(pairs):
+            nums = iter(map(int, x.replace("-", " ").split()))
+            return list(zip(nums, nums))
         ret = []
-        if len(x) != 0:
-            for y in self.parse_words(x):
-                y = y.split("-")
-                ret.append((int(y[0]), (int(y[1]))))
+        for y in pairs:
+            y = y.split("-")
+            ret.append((int(y[0]), (int(y[1]))))
         return ret
+    # Parse one tuple of input lines: src, trg1, align1, trg2, align2, ...
+    def parse_lines(self, strs):
+        strs = [x.strip() for x in strs]
+        words = [self.parse_words(strs[0])]
+        for x in strs[1::2]:
+            words.append(self.parse_words(x))
+        aligns = [ self.parse_align(x) for x in strs[2::2] ]
+        return words, aligns
     
+    # Build a sparse table over vals for constant-time range queries, where
+    # table[k][i] is the min (or max) of vals[i:i+2**k]
+    def build_range_table(self, vals, func):
+        table = [vals]
+        width = 1
+        while 2*width <= len(vals):
+            prev = table[-1]
+            table.append([func(prev[i], prev[i+width]) for i in range(len(prev)-width)])
+            width *= 2
+        return table
+
     # Phrase extraction function
     #  phrases are in the format [ (src_left, src_right), (trg1_left, trg1_right), ... ]
     # align is the list of alignments for the next span to be added
     def extract_phrases(self, phrases, align):
         ret = []
-        # Get the closures of all target words and alignments of all src words
-        ialigns = defaultdict(lambda: [])
-        jclosures = defaultdict(lambda: (self.max_len, -1))
+        if len(align) == 0 or len(phrases) == 0:
+            return ret
+        # Get the min/max target word aligned to each src word, and the
+        # closure (min/max src word) of each target word
+        src_len = max(max([i for i, j in align]), max([p[0][1] for p in phrases]) - 1) + 1
+        trg_len = max([j for i, j in align]) + 1
+        imins, imaxs = [self.max_len]*src_len, [-1]*src_len
+        jmins, jmaxs = [self.max_len]*trg_len, [-1]*trg_len
         for i, j in align:
-            jclosures[j] = (min(i, jclosures[j][0]), max(i, jclosures[j][1]))
-            ialigns[i].append(j)    
-        # For all src spans, check if they are ok
+            if j < imins[i]: imins[i] = j
+            if j > imaxs[i]: imaxs[i] = j
+            if i < jmins[j]: jmins[j] = i
+            if i > jmaxs[j]: jmaxs[j] = i
+        imins, imaxs = self.build_range_table(imins, min), self.build_range_table(imaxs, max)
+        jmins, jmaxs = self.build_range_table(jmins, min), self.build_range_table(jmaxs, max)
+        # For all src spans, find the target projection and check that
+        # nothing in it aligns outside of the src span
         for phrase in phrases:
-            ok = True
-            trg_span = (self.max_len, -1)
-            for i in range(*phrase[0]):
-                for j in ialigns[i]:
-                    trg_span = (min(trg_span[0], j), max(trg_span[1], j+1))
-            if trg_span[0] == self.max_len:
+            self.check_deadline()
+            i_left, i_right = phrase[0]
+            level = (i_right-i_left).bit_length()-1
+            i_mid = i_right-(1 << level)
+            j_left = min(imins[level][i_left], imins[level][i_mid])
+            if j_left == self.max_len:
+                continue
+            j_right = max(imaxs[level][i_left], imaxs[level][i_mid]) + 1
+            level = (j_right-j_left).bit_length()-1
+            j_mid = j_right-(1 << level)
+            if min(jmins[level][j_left], jmins[level][j_mid]) < i_left or max(jmaxs[level][j_left], jmaxs[level][j_mid]) >= i_right:
                 continue
-            for j in range(*trg_span):
-                if jclosures[j][0] < phrase[0][0] or jclosures[j][1] >= phrase[0][1]:
-                    ok = False
-                    break
-            if ok:
-                phrase.append(trg_span)
-                ret.append(phrase)
+            phrase.append((j_left, j_right))
+            ret.append(phrase)
         return ret
     
+    # Return true if the number of terminal symbols in each language is OK
+    def syms_filter(self, syms):
+        for x, y in zip(syms, self.max_sym):
+            if x > y:
+                return False
+        return True
+
     # Return true if the rule is OK, false if not
     def rule_filter(self, rule):
         # Is the number of symbols OK?
         lens = [rule[0][i][1]-rule[0][i][0]-sum([y[i][1]-y[i][0] for y in rule[1:]]) for i in range(len(rule[0]))]
-        for i, syms in enumerate(lens):
-            if syms > self.max_sym[i]:
-                return 0
-        return 1
+        return 1 if self.syms_filter(lens) else 0
     
-    # Take phrases and make hiero phrases
-    def abstract_phrases(self, phrases, holes):
-        # Index phrases to use as holes (use all phrases for now)
+    # Index phrases to use as holes by their left src position
+    def index_holes(self, holes):
         hole_idxs = defaultdict(lambda: [])
         for idx, (i_left, i_right) in enumerate([x[0] for x in holes]):
             hole_idxs[i_left].append( (i_right, idx) )
-        # Create all non-abstracted phrases
-        ret = []
-        cnt = []
-        for phrase in phrases:
-            # Add each phrase
-            idx = idx_start = len(ret)
-            ret.append( (phrase,) )
-            while idx < len(ret):
-                curr = ret[idx]
-                idx += 1
-                # Skip if we already have enough non-terms
-                if len(curr) > self.max_nonterm:
-                    continue
-                # Start checking the remaining holes either at
-                # the beginning of the phrase, or the end of the last hole
-                i_start = curr[0][0][0] if len(curr) == 1 else curr[-1][0][1]+self.min_src_interceding
-                for i_left in range(i_start, curr[0][0][1]):
+        return hole_idxs
+
+    # Iterate over the rules made by adding one more hole to curr, along
+    # with the number of terminal symbols they have in each language.
+    # Holes covering fewer than min_src src words are skipped, as are holes
+    # that leave src terminals before them that fail chunk_filter
+    def iter_children(self, curr, syms, holes, hole_idxs, min_src=0, chunk_filter=None):
+        self.check_deadline()
+        # Skip if we already have enough non-terms
+        if len(curr) > self.max_nonterm:
+            return
+        # Start checking the remaining holes either at
+        # the beginning of the phrase, or the end of the last hole
+        span = curr[0][0]
+        i_start = span[0] if len(curr) == 1 else curr[-1][0][1]+self.min_src_interceding
+        # Stop if even covering everything after i_start with holes would
+        # leave too many src terminals
+        if syms[0] - (span[1] - i_start) > self.max_sym_src:
+            return
+        for i_left in range(i_start, span[1]):
+            for i_right, i_idx in hole_idxs[i_left]:
+                # If we don't exceed the right side or cover the whole phrase
+                if i_right <= span[1] and span != holes[i_idx][0] and i_right-i_left >= min_src:
+                    # The terminals before this hole can't change any more.
+                    # If they fail, so will the longer ones of later holes
+                    if chunk_filter and not chunk_filter(self.last_end(curr), i_left):
+                        return
+                    hole = holes[i_idx]
+                    yield curr + (hole,), [x-(y[1]-y[0]) for x, y in zip(syms, hole)]
+
+    # Get the end of the last hole, or the start of the phrase if none
+    def last_end(self, curr):
+        return curr[0][0][0] if len(curr) == 1 else curr[-1][0][1]
+
+    # Count the rules that can be made from a phrase span, where i_start is
+    # the first position a new hole can start at. This includes the rules
+    # that do not pass the symbol limits
+    def count_rules(self, span, i_start, num_holes, hole_idxs, memo):
+        key = (span, i_start, num_holes)
+        if key not in memo:
+            self.check_deadline()
+            ret = 1
+            if num_holes < self.max_nonterm:
+                for i_left in range(i_start, span[1]):
                     for i_right, i_idx in hole_idxs[i_left]:
-                        # If we don't exceed the right side or cover the whole phrase
-                        if i_right <= curr[0][0][1] and curr[0][0] != holes[i_idx][0]:
-                            ret.append( curr + (holes[i_idx],) )
-            # Add the cnt divided by the number of elements
-            num_elem = idx-idx_start
-            cnt.extend( (1.0/num_elem,)*num_elem )
-        return [x for x in zip(ret, cnt) if self.rule_filter(x[0])]
-    
-    # Create a single string of abstracted rules
-    def create_phrase_string(self, words, span, holes):
-        # Find the holes
-        sorted_holes = sorted(enumerate(holes), key=lambda x: x[1][0])
-        # sorted_holes.sort(key=lambda x: x[1][0])
-        # Add the values one by one
-        prev = span[0]
-        ret = []
-        for idx, (start, end) in sorted_holes:
-            # Add the words
-            if prev != start:
-                ret.append('"'+'" "'.join(words[prev:start])+'"')
-            # Add the hole
-            ret.append("x%d:X" % idx)
-            prev = end
-        if prev != span[1]:
-            ret.append('"'+'" "'.join(words[prev:span[1]])+'" @ X')
+                        if i_right <= span[1] and span != (i_left, i_right):
+                            ret += self.count_rules(span, i_right+self.min_src_interceding, num_holes+1, hole_idxs, memo)
+            memo[key] = ret
+        return memo[key]
+
+    # Iterate over the rules that pass the symbol limits (and chunk_filter,
+    # if given) with exactly depth more holes than curr. Doing this for
+    # increasing depths gives the rules in breadth-first order
+    def iter_descendants(self, curr, syms, holes, hole_idxs, depth, chunk_filter=None):
+        if depth == 0:
+            if self.syms_filter(syms) and self.end_filter(curr, chunk_filter):
+                yield curr
+        elif depth == 1:
+            # The last hole must cover enough src words to meet the limit
+            for child, child_syms in self.iter_children(curr, syms, holes, hole_idxs, syms[0]-self.max_sym_src, chunk_filter):
+                if self.syms_filter(child_syms) and self.end_filter(child, chunk_filter):
+                    yield child
         else:
-            ret.append('@ X')
-        return ' '.join(ret)
+            for child, child_syms in self.iter_children(curr, syms, holes, hole_idxs, 0, chunk_filter):
+                yield from self.iter_descendants(child, child_syms, holes, hole_idxs, depth-1, chunk_filter)
+
+    # Return true if the src terminals after the last hole pass chunk_filter
+    def end_filter(self, curr, chunk_filter):
+        start = self.last_end(curr)
+        return not chunk_filter or start == curr[0][0][1] or chunk_filter(start, curr[0][0][1])
+
+    # Create a function checking if src_words[start:end] are in the src
+    # filter, caching the results for the sentence
+    def create_chunk_filter(self, src_words):
+        cache = {}
+        def chunk_filter(start, end):
+            if start == end:
+                return True
+            key = (start, end)
+            if key not in cache:
+                cache[key] = self.src_filter.contains(src_words, start, end)
+            return cache[key]
+        return chunk_filter
+
+    # Take phrases and make hiero phrases, yielding (rule, count) pairs
+    # one at a time. Unless norm_kept is set, the count of each phrase is
+    # divided evenly between all the rules made from it, including those
+    # that are filtered out. If src_words are given, rules are also
+    # filtered by the src filter, without changing the counts
+    def iter_abstract_phrases(self, phrases, holes, src_words=None):
+        hole_idxs = self.index_holes(holes)
+        chunk_filter = self.create_chunk_filter(src_words) if self.src_filter is not None and src_words is not None else None
+        memo = {}
+        for phrase in phrases:
+            curr = (phrase,)
+            syms = [x[1]-x[0] for x in phrase]
+            if self.norm_kept:
+                num_elem = sum([sum(1 for x in self.iter_descendants(curr, syms, holes, hole_idxs, depth)) for depth in range(self.max_nonterm+1)])
+            else:
+                num_elem = self.count_rules(phrase[0], phrase[0][0], 0, hole_idxs, memo)
+            for depth in range(self.max_nonterm+1):
+                for rule in self.iter_descendants(curr, syms, holes, hole_idxs, depth, chunk_filter):
+                    yield rule, 1.0/num_elem
+
+    # Take phrases and make hiero phrases
+    def abstract_phrases(self, phrases, holes):
+        return list(self.iter_abstract_phrases(phrases, holes))
     
+    # Create a single string of abstracted rules for one language. The
+    # rendering is done by RuleRenderer, which also renders whole sentences
+    def create_phrase_string(self, words, span, holes):
+        return RuleRenderer.RuleRenderer([words]).create_phrase_string(0, tuple(span), tuple(holes))
+
     # Convert a full rule into a travatar-style representation
     def create_rule_string(self, words, phrase, count):
-        span = phrase[0]
-        holes = phrase[1:]
-        strs = [ self.create_phrase_string(words[x], span[x], [y[x] for y in holes]) for x in range(0, len(words)) ]
-        return "%s ||| %s ||| %f" % (strs[0], " |COL| ".join(strs[1:]), count)
+        return RuleRenderer.RuleRenderer(words).create_rule_string(phrase, count)
 
     # Get a list of sets of non-null alignments
     def create_nonnull(self, aligns):
@@ -144,36 +275,240 @@ class RuleExtractor(object):
                     phrases.append( [(i,j)] )
         return phrases
 
-    # Extend the range of a phrase to cover all neighboring null alignments
-    def extend_range(self, phrase, nonnull, wordlen):
+    # Find how far the range of a phrase can extend over null alignments
+    def extend_edges(self, phrase, nonnull, wordlen):
         start = phrase[0]
         while start > 0 and not start-1 in nonnull:
             start -= 1
         end = phrase[1]
         while end < wordlen and not end in nonnull:
             end += 1
+        return start, end
+
+    # Extend the range of a phrase to cover all neighboring null alignments
+    def extend_range(self, phrase, nonnull, wordlen):
+        start, end = self.extend_edges(phrase, nonnull, wordlen)
         return itertools.product(range(start,phrase[0]+1), range(phrase[1],end+1))
 
-    # Add null alignments to existing phrases
-    def add_nulls(self, words, phrases, nonnulls):
+    # Add null alignments to existing phrases, one phrase at a time
+    def iter_nulls(self, words, phrases, nonnulls):
         # For each phrase, expand the edges
         # Take the cross-product of the expanded edges
-        ret = []
         for phrase in phrases:
+            self.check_deadline()
             extended = [self.extend_range(x, y, len(w)) for w, x, y in zip(words, phrase, nonnulls)]
-            ret.extend( itertools.product(*extended) )
-        return [list(x) for x in ret]
+            for x in itertools.product(*extended):
+                yield list(x)
+
+    # Add null alignments to existing phrases
+    def add_nulls(self, words, phrases, nonnulls):
+        return list(self.iter_nulls(words, phrases, nonnulls))
+
+    # Count the phrases add_nulls would make without making them
+    def count_nulls(self, words, phrases, nonnulls):
+        ret = 0
+        for phrase in phrases:
+            self.check_deadline()
+            num = 1
+            for w, x, y in zip(words, phrase, nonnulls):
+                start, end = self.extend_edges(x, y, len(w))
+                num *= (x[0]-start+1) * (end-x[1]+1)
+            ret += num
+        return ret
+
+    # Count the rules abstract_phrases would enumerate with max_nonterm,
+    # including those that do not pass the filters
+    def count_abstract(self, phrases, holes, max_nonterm):
+        default, self.max_nonterm = self.max_nonterm, max_nonterm
+        try:
+            hole_idxs = self.index_holes(holes)
+            memo = {}
+            return sum([self.count_rules(x[0], x[0][0], 0, hole_idxs, memo) for x in phrases])
+        finally:
+            self.max_nonterm = default
+
+    # Start the time budget of a sentence, if there is one
+    def start_deadline(self):
+        self.deadline = time.perf_counter()+self.max_time if self.max_time > 0 else None
+
+    # Raise BudgetExceeded if the time budget of the current sentence has run
+    # out. This is checked at every step of extraction, so a sentence stops
+    # soon after the deadline wherever the time is spent
+    def check_deadline(self):
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise BudgetExceeded()
+
+    # Report a sentence over a budget
+    def log_budget(self, lineno, limit, action, skipped):
+        print("Line %d: over the %s budget, %s" % (lineno, limit, action), file=self.log)
+        if self.stats is not None:
+            self.stats.counts["skipped_sents" if skipped else "degraded_sents"] += 1
+
+    # Apply the phrase and rule budgets to a sentence, returning the phrases
+    # to abstract and the max_nonterm to use, or None for the phrases if the
+    # sentence is skipped
+    def apply_budgets(self, words, holes, nonnull, lineno):
+        phrases = self.iter_nulls(words, holes, nonnull)
+        if self.max_phrases > 0 and self.count_nulls(words, holes, nonnull) > self.max_phrases:
+            if self.budget_action == "skip" or len(holes) > self.max_phrases:
+                self.log_budget(lineno, "phrase", "skipping", True)
+                return None, self.max_nonterm
+            self.log_budget(lineno, "phrase", "not adding nulls", False)
+            phrases = [list(x) for x in holes]
+        max_nonterm = self.max_nonterm
+        if self.max_rules > 0:
+            phrases = list(phrases)
+            while self.count_abstract(phrases, holes, max_nonterm) > self.max_rules:
+                if self.budget_action == "skip" or max_nonterm == 0:
+                    self.log_budget(lineno, "rule", "skipping", True)
+                    return None, self.max_nonterm
+                max_nonterm -= 1
+            if max_nonterm != self.max_nonterm:
+                self.log_budget(lineno, "rule", "using max_nonterm %d" % max_nonterm, False)
+        return phrases, max_nonterm
+
+    # Abstract phrases with max_nonterm, raising BudgetExceeded if the time
+    # budget runs out. The deadline of the sentence ends with the rules
+    def iter_budget_rules(self, phrases, holes, src_words, max_nonterm):
+        default, self.max_nonterm = self.max_nonterm, max_nonterm
+        try:
+            yield from self.iter_abstract_phrases(phrases, holes, src_words)
+        finally:
+            self.max_nonterm = default
+            self.deadline = None
+
+    # Create rules from words and alignments, yielding (rule, count) pairs
+    # one at a time so only the holes are kept in memory. If there are
+    # budgets, this raises BudgetExceeded when the time budget runs out,
+    # either here or while iterating, and lineno is the line number to report
+    def iter_hiero_rules(self, words, aligns, lineno=0):
+        self.start_deadline()
+        try:
+            # Get non-null alignments
+            nonnull = self.create_nonnull(aligns)
+            # Get the alignable src phrases
+            holes = self.create_minimal_srcs(nonnull[0], len(words[0]))
+            # For each target, add the alignable targets
+            for word, g in zip(words[1:], aligns):
+                holes = self.extract_phrases(holes, g)
+            # Holes will only be minimal phrases, but for actual extracted
+            # phrases we will add null-aligned words
+            if not self.budgets:
+                phrases = self.iter_nulls(words, holes, nonnull)
+                return self.iter_abstract_phrases(phrases, holes, words[0])
+            phrases, max_nonterm = self.apply_budgets(words, holes, nonnull, lineno)
+        except BudgetExceeded:
+            self.deadline = None
+            raise
+        if phrases is None:
+            self.deadline = None
+            return iter(())
+        return self.iter_budget_rules(phrases, holes, words[0], max_nonterm)
 
     # Create rules from words and alignments
     def create_hiero_rules(self, words, aligns):
-        # Get non-null alignments
-        nonnull = self.create_nonnull(aligns)
-        # Get the alignable src phrases
-        holes = self.create_minimal_srcs(nonnull[0], len(words[0]))
-        # For each target, add the alignable targets
-        for word, g in zip(words[1:], aligns):
-            holes = self.extract_phrases(holes, g)
-        # Holes will only be minimal phrases, but for actual extracted
-        # phrases we will add null-aligned words
-        phrases = self.add_nulls(words, holes, nonnull)
-        return self.abstract_phrases(phrases, holes)
+        return list(self.iter_hiero_rules(words, aligns))
+
+    # Create the rule strings for one tuple of input lines. If a RuleCache is
+    # given, repeated sentences reuse the cached strings. lineno is only
+    # used to record the slowest sentences in stats and report sentences
+    # over the budgets
+    def create_rule_strings(self, strs, cache=None, lineno=0):
+        return list(self.iter_rule_strings(strs, cache, lineno))
+
+    # The same as create_rule_strings, but yielding the strings one at a time
+    # as they are rendered. Only sentences that may go into the cache, or
+    # that must be dropped if they run over the time budget, are kept in a
+    # list. With stats, the stages are run one after another, so each
+    # sentence is kept in a list
+    def iter_rule_strings(self, strs, cache=None, lineno=0):
+        if self.stats is not None:
+            start = time.perf_counter()
+            ret = self.create_rule_strings_timed(strs, cache, lineno)
+            self.stats.add_sentence(lineno, time.perf_counter()-start)
+            yield from ret
+            return
+        words, aligns = self.parse_lines(strs)
+        if cache is not None:
+            key = cache.make_key(words, aligns)
+            ret = cache.get(key)
+            if ret is not None:
+                yield from ret
+                return
+        renderer = RuleRenderer.RuleRenderer(words)
+        # A sentence over the time budget is dropped, so render all of it
+        # before yielding anything
+        try:
+            rule_strs = (renderer.create_rule_string(hiero, hcount) for hiero, hcount in self.iter_hiero_rules(words, aligns, lineno))
+            if self.max_time > 0:
+                rule_strs = list(rule_strs)
+        except BudgetExceeded:
+            self.log_budget(lineno, "time", "skipping", True)
+            return
+        if cache is None:
+            yield from rule_strs
+            return
+        # Keep the strings for the cache until there are too many to cache
+        kept = []
+        for rule_str in rule_strs:
+            if kept is not None:
+                kept.append(rule_str)
+                if len(kept) > min(cache.max_rules, cache.max_sent_rules):
+                    kept = None
+            yield rule_str
+        if kept is not None:
+            cache.put(key, kept)
+
+    # The same as create_rule_strings, but running each stage separately to
+    # add its time and counts to stats
+    def create_rule_strings_timed(self, strs, cache=None, lineno=0):
+        times, counts = self.stats.times, self.stats.counts
+        start = time.perf_counter()
+        words, aligns = self.parse_lines(strs)
+        if cache is not None:
+            key = cache.make_key(words, aligns)
+            ret = cache.get(key)
+            if ret is not None:
+                counts["cached_sents"] += 1
+                counts["rules"] += len(ret)
+                times["parse"] += time.perf_counter()-start
+                return ret
+        parsed = time.perf_counter()
+        # The time budget starts after parsing, as in iter_hiero_rules
+        self.start_deadline()
+        try:
+            nonnull = self.create_nonnull(aligns)
+            holes = self.create_minimal_srcs(nonnull[0], len(words[0]))
+            counts["candidate_spans"] += len(holes)
+            for word, g in zip(words[1:], aligns):
+                holes = self.extract_phrases(holes, g)
+            extracted = time.perf_counter()
+            phrases, max_nonterm = self.apply_budgets(words, holes, nonnull, lineno) if self.budgets else (self.iter_nulls(words, holes, nonnull), self.max_nonterm)
+            phrases = list(phrases) if phrases is not None else []
+            nulled = time.perf_counter()
+            rules = list(self.iter_budget_rules(phrases, holes, words[0], max_nonterm))
+        except BudgetExceeded:
+            self.log_budget(lineno, "time", "skipping", True)
+            return []
+        finally:
+            self.deadline = None
+        abstracted = time.perf_counter()
+        renderer = RuleRenderer.RuleRenderer(words)
+        ret = [renderer.create_rule_string(hiero, hcount) for hiero, hcount in rules]
+        rendered = time.perf_counter()
+        if cache is not None:
+            cache.put(key, ret)
+        times["parse"] += parsed-start
+        times["phrases"] += extracted-parsed
+        times["nulls"] += nulled-extracted
+        times["abstract"] += abstracted-nulled
+        times["render"] += rendered-abstracted
+        # Count all the rules enumerated from the phrases, including those
+        # that were filtered out
+        combinations = self.count_abstract(phrases, holes, max_nonterm)
+        counts["consistent_phrases"] += len(holes)
+        counts["null_phrases"] += len(phrases)
+        counts["hole_combinations"] += combinations
+        counts["filtered_rules"] += combinations-len(rules)
+        counts["rules"] += len(rules)
+        return ret
@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+
+class RuleRenderer(object):
+
+    # Renders the rules of a single sentence in the travatar format, caching
+    # the pieces that are shared between rules. RuleExtractor's
+    # create_phrase_string and create_rule_string use it for single rules
+    def __init__(self, words):
+        # Quote each word once
+        self.words = [['"'+x+'"' for x in y] for y in words]
+        # Caches of rendered word sequences, rule sides, and counts
+        self.terms = {}
+        self.sides = {}
+        self.counts = {}
+
+    # Render the terminals words[lang][start:end], or "" if there are none,
+    # which happens when an alignment points past the end of a sentence
+    def create_terms_string(self, lang, start, end):
+        key = (lang, start, end)
+        if key not in self.terms:
+            self.terms[key] = ' '.join(self.words[lang][start:end]) or '""'
+        return self.terms[key]
+
+    # Create a single string of abstracted rules for one language
+    def create_phrase_string(self, lang, span, holes):
+        key = (lang, span, holes)
+        if key in self.sides:
+            return self.sides[key]
+        # Find the holes
+        sorted_holes = sorted(enumerate(holes), key=lambda x: x[1][0])
+        # Add the values one by one
+        prev = span[0]
+        ret = []
+        for idx, (start, end) in sorted_holes:
+            # Add the words
+            if prev != start:
+                ret.append(self.create_terms_string(lang, prev, start))
+            # Add the hole
+            ret.append("x%d:X" % idx)
+            prev = end
+        if prev != span[1]:
+            ret.append(self.create_terms_string(lang, prev, span[1])+' @ X')
+        else:
+            ret.append('@ X')
+        ret = self.sides[key] = ' '.join(ret)
+        return ret
+
+    # Convert a full rule into a travatar-style representation
+    def create_rule_string(self, phrase, count):
+        span = phrase[0]
+        holes = phrase[1:]
+        strs = [ self.create_phrase_string(x, span[x], tuple([y[x] for y in holes])) for x in range(0, len(self.words)) ]
+        if count not in self.counts:
+            self.counts[count] = "%f" % count
+        return "%s ||| %s ||| %s" % (strs[0], " |COL| ".join(strs[1:]), self.counts[count])
@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+
+from collections import defaultdict
+import math
+import os
+import tempfile
+import RuleAggregator
+
+# Read a lexical probability file with lines "word given_word prob"
+def read_lex_probs(filename):
+    ret = defaultdict(lambda: {})
+    with open(filename, "r") as lex_file:
+        for line in lex_file:
+            cols = line.split()
+            if len(cols) == 3:
+                ret[cols[1]][cols[0]] = float(cols[2])
+    return ret
+
+class RuleScorer(object):
+
+    # Scores the combined table and each target factor in both directions,
+    # in the format written by Travatar's score-t2s.pl. Table 0 is the
+    # combined table and table k+1 is factor k. lex_probs is a list with
+    # one (trg_given_src, src_given_trg) pair of tables per factor. max_mem
+    # is the memory budget in MB for the target counts and for each sort
+    def __init__(self, num_trgs, lex_probs=None, tmpdir=None, max_mem=1024):
+        # Parameters
+        self.num_trgs = num_trgs
+        self.lex_probs = lex_probs
+        self.tmpdir = tmpdir
+        self.max_mem = max_mem
+        # The feature prefixes of each table
+        self.prefixes = [""] + [str(x) for x in range(num_trgs)]
+        # Constants
+        self.min_prob = 1e-7
+
+    # Get the terminal words from one side of a rule
+    def get_words(self, side):
+        return [x[1:-1] for x in side.split(" ") if len(x) > 1 and x[0] == '"' and x[-1] == '"']
+
+    # Calculate the model 1 log probability of words e given words f
+    def lex_prob(self, e, f, probs):
+        ret = 0.0
+        for e_word in e:
+            prob = probs["NULL"].get(e_word, 0.0)
+            for f_word in f:
+                prob += probs[f_word].get(e_word, 0.0)
+            ret += math.log(max(prob/(len(f)+1), self.min_prob))
+        return ret
+
+    # Format a feature value in the same way as perl
+    def format_value(self, val):
+        return "%.15g" % val
+
+    # Iterate over sorted (key, count) pairs with keys "src ||| trg ||| ",
+    # grouped into (src, [(trg, count), ...]) by src
+    def iter_src_groups(self, items):
+        prev_src, trgs = None, []
+        for key, count in items:
+            src, trg, _ = key.split(" ||| ")
+            if src != prev_src:
+                if prev_src is not None:
+                    yield prev_src, trgs
+                prev_src, trgs = src, []
+            trgs.append((trg, count))
+        if prev_src is not None:
+            yield prev_src, trgs
+
+    # Create the src-to-trg features of a rule in a table
+    def create_egf_feats(self, table, src, trg, count, src_count):
+        prefix = self.prefixes[table]
+        feats = ["%segfp=%s" % (prefix, self.format_value(math.log(count/src_count)))]
+        if table > 0 and self.lex_probs:
+            feats.append("%segfl=%s" % (prefix, self.format_value(self.lex_prob(self.get_words(trg), self.get_words(src), self.lex_probs[table-1][0]))))
+        # The joint features
+        feats.append("%sp=1" % prefix)
+        num_words = len(self.get_words(trg))
+        if num_words:
+            feats.append("%sw=%d" % (prefix, num_words))
+        feats.append("%slfreq=%s" % (prefix, self.format_value(math.log(count))))
+        return " ".join(feats)
+
+    # Create the trg-to-src features of a rule in a table
+    def create_fge_feats(self, table, src, trg, count, trg_count):
+        prefix = self.prefixes[table]
+        feats = ["%sfgep=%s" % (prefix, self.format_value(math.log(count/trg_count)))]
+        if table > 0 and self.lex_probs:
+            feats.append("%sfgel=%s" % (prefix, self.format_value(self.lex_prob(self.get_words(src), self.get_words(trg), self.lex_probs[table-1][1]))))
+        return " ".join(feats)
+
+    # Score sorted (key, count) items in a single pass. The src-to-trg
+    # tables are written as the items are read, and the rule counts are
+    # spooled to disk to write the trg-to-src tables once the target counts
+    # are known. The target counts are keyed on "table ||| trg ||| " and are
+    # spilled to disk if they don't fit in max_mem. egf_outs and fge_outs
+    # have one file per table
+    def score(self, items, egf_outs, fge_outs):
+        trg_counts = RuleAggregator.RuleAggregator(max_mem=self.max_mem, tmpdir=self.tmpdir)
+        fd, spool_name = tempfile.mkstemp(prefix="rule-score.", suffix=".txt", dir=self.tmpdir)
+        try:
+            with os.fdopen(fd, "w") as spool:
+                for src, trgs in self.iter_src_groups(items):
+                    # Count each target and factor for this src
+                    counts = [defaultdict(float) for x in self.prefixes]
+                    src_count = 0.0
+                    for trg, count in trgs:
+                        counts[0][trg] += count
+                        for table, col in enumerate(trg.split(" |COL| "), 1):
+                            counts[table][col] += count
+                        src_count += count
+                    for table, table_counts in enumerate(counts):
+                        for trg in sorted(table_counts, key=lambda x: x+" ||| "):
+                            count = table_counts[trg]
+                            egf_outs[table].write("%s ||| %s ||| %s\n" % (src, trg, self.create_egf_feats(table, src, trg, count, src_count)))
+                            trg_counts.add_count("%d ||| %s ||| " % (table, trg), count)
+                            spool.write("%d ||| %s ||| %s ||| %r\n" % (table, src, trg, count))
+            if trg_counts.runs:
+                self.write_fge_spilled(spool_name, trg_counts, fge_outs)
+            else:
+                with open(spool_name, "r") as spool:
+                    for line in spool:
+                        table, src, trg, count = line.split(" ||| ")
+                        trg_count = trg_counts.counts["%s ||| %s ||| " % (table, trg)]
+                        table, count = int(table), float(count)
+                        fge_outs[table].write("%s ||| %s ||| %s\n" % (src, trg, self.create_fge_feats(table, src, trg, count, trg_count)))
+        finally:
+            trg_counts.close()
+            os.remove(spool_name)
+
+    # Write the trg-to-src tables when the target counts have been spilled
+    # to disk. The spooled rules are sorted by target to merge them with the
+    # sorted target counts, then sorted back into the order of the spool
+    def write_fge_spilled(self, spool_name, trg_counts, fge_outs):
+        by_trg = RuleAggregator.RuleAggregator(max_mem=self.max_mem, tmpdir=self.tmpdir)
+        by_line = RuleAggregator.RuleAggregator(max_mem=self.max_mem, tmpdir=self.tmpdir)
+        try:
+            with open(spool_name, "r") as spool:
+                for i, line in enumerate(spool):
+                    table, src, trg, count = line.split(" ||| ")
+                    by_trg.add_count("%s ||| %s ||| %012d ||| %s ||| " % (table, trg, i, src), float(count))
+            counts = trg_counts.items()
+            trg_key, trg_count = None, 0.0
+            for key, count in by_trg.items():
+                table, trg, i, src, _ = key.split(" ||| ")
+                while trg_key != "%s ||| %s ||| " % (table, trg):
+                    trg_key, trg_count = next(counts)
+                by_line.add_count("%s ||| %s ||| %s ||| %s ||| %r ||| " % (i, table, src, trg, count), trg_count)
+            for key, trg_count in by_line.items():
+                i, table, src, trg, count, _ = key.split(" ||| ")
+                table, count = int(table), float(count)
+                fge_outs[table].write("%s ||| %s ||| %s\n" % (src, trg, self.create_fge_feats(table, src, trg, count, trg_count)))
+        finally:
+            by_trg.close()
+            by_line.close()
@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+
+import gzip
+import json
+import os
+
+class RuleStore(object):
+
+    # A directory of aggregated rule counts, with a manifest of the
+    # extraction parameters and how much of each input file has been
+    # extracted, so later runs only extract the lines added since
+    #  manifest.json: {"params": ..., "files": [{"name", "lines", "bytes"}],
+    #                  "generation": the number of updates,
+    #                  "counts": the name of the counts file}
+    #  counts.N.gz: the counts as a sorted run of RuleAggregator
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.manifest = None
+        manifest_file = os.path.join(dirname, "manifest.json")
+        if os.path.exists(manifest_file):
+            with open(manifest_file, "r") as manifest:
+                self.manifest = json.load(manifest)
+        # The number of lines and bytes read from each file, including those
+        # already in the store
+        self.read = []
+
+    # Get the counts file of the store, or None if it is empty
+    def counts_file(self):
+        if self.manifest is None:
+            return None
+        return os.path.join(self.dirname, self.manifest["counts"])
+
+    # Check that the store was built with the same parameters and files
+    def check(self, params, filenames):
+        if self.manifest is None:
+            return
+        if self.manifest["params"] != params:
+            raise Exception("The rules in %s were extracted with different parameters: %s" % (self.dirname, self.manifest["params"]))
+        names = [x["name"] for x in self.manifest["files"]]
+        if names != [os.path.abspath(x) for x in filenames]:
+            raise Exception("The rules in %s were extracted from different files: %s" % (self.dirname, " ".join(names)))
+
+    # Open a file after the part already in the store, checking that the
+    # part still ends at a line break. Yields the new lines, and counts the
+    # lines and bytes read in self.read[idx]
+    def read_new_lines(self, idx, filename):
+        lines, num_bytes = 0, 0
+        if self.manifest is not None:
+            lines, num_bytes = self.manifest["files"][idx]["lines"], self.manifest["files"][idx]["bytes"]
+        self.read.append([lines, num_bytes])
+        with (gzip.open(filename, "rb") if filename.endswith(".gz") else open(filename, "rb")) as in_file:
+            if num_bytes > 0:
+                in_file.seek(num_bytes-1)
+                if in_file.read(1) != b"\n":
+                    raise Exception("%s has changed since its first %d lines were extracted" % (filename, lines))
+            for line in in_file:
+                self.read[idx][0] += 1
+                self.read[idx][1] += len(line)
+                yield line.decode("utf-8")
+
+    # Open the new lines of each file
+    def open_files(self, filenames):
+        return [self.read_new_lines(i, x) for i, x in enumerate(filenames)]
+
+    # Get the number of lines already in the store
+    def start_line(self):
+        return self.manifest["files"][0]["lines"] if self.manifest is not None else 0
+
+    # Open a new counts file to write the merged counts to
+    def open_counts(self):
+        os.makedirs(self.dirname, exist_ok=True)
+        generation = self.manifest["generation"]+1 if self.manifest is not None else 0
+        self.new_counts = "counts.%d.gz" % generation
+        self.generation = generation
+        return gzip.open(os.path.join(self.dirname, self.new_counts), "wt", compresslevel=6)
+
+    # Write the manifest for the new counts file, then remove the old one
+    def commit(self, params, filenames):
+        if len(set([x[0] for x in self.read])) > 1:
+            raise Exception("The input files have different numbers of lines: %s" % " ".join([str(x[0]) for x in self.read]))
+        old_counts = self.counts_file()
+        manifest = {"params": params,
+                    "generation": self.generation,
+                    "counts": self.new_counts,
+                    "files": [{"name": os.path.abspath(x), "lines": y[0], "bytes": y[1]} for x, y in zip(filenames, self.read)]}
+        manifest_file = os.path.join(self.dirname, "manifest.json")
+        with open(manifest_file+".tmp", "w") as out:
+            json.dump(manifest, out, indent=2)
+        os.replace(manifest_file+".tmp", manifest_file)
+        self.manifest = manifest
+        if old_counts is not None and old_counts != self.counts_file():
+            os.remove(old_counts)
@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+
+from array import array
+import mmap
+import struct
+import sys
+
+# The binary format is laid out as:
+#  header: magic, version, the number of words, feature names, srcs and
+#          rules, and the offset of each of the sections below
+#  rules: for each rule, the number of target columns, then for each
+#         column the number of words and the word ids, then the number of
+#         features and (feature id, value) pairs
+#  rule offsets: the offset of each rule in rules
+#  src index: (key offset, key length, first rule, number of rules) for
+#             each src, sorted by the src key "src ||| " as bytes
+#  src keys: the src keys, in UTF-8
+#  words, feature names: the offset of each string, then the strings
+MAGIC = b"MRT1"
+VERSION = 1
+HEADER = struct.Struct("<4sIIIII7Q")
+SRC_ENTRY = struct.Struct("<QIII")
+COUNT = struct.Struct("<H")
+WORD = struct.Struct("<I")
+FEAT = struct.Struct("<Id")
+
+# Get the bytes of an array in little-endian order
+def to_le_bytes(arr):
+    if sys.byteorder == "big":
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+class RuleTableWriter(object):
+
+    # Writes a binary rule table from text rules "src ||| trg ||| feats",
+    # which must be grouped and sorted by src like the output of
+    # combine-multi.py
+    def __init__(self, filename):
+        self.out = open(filename, "wb")
+        self.out.write(b"\0" * HEADER.size)
+        # Interned words and feature names
+        self.words = {}
+        self.feats = {}
+        # The offsets of the rules and the src index
+        self.rule_offsets = array("Q")
+        self.srcs = []
+        self.prev_key = None
+
+    # Get the id of a string, adding it if it is new
+    def intern(self, table, string):
+        ret = table.get(string)
+        if ret is None:
+            ret = table[string] = len(table)
+        return ret
+
+    # Add a single line of a text rule table
+    def add(self, line):
+        src, trg, feats = line.rstrip("\n").split(" ||| ")
+        key = (src+" ||| ").encode("utf-8")
+        if key != self.prev_key:
+            if self.prev_key is not None and key < self.prev_key:
+                raise Exception("Rule table is not sorted by src at: %s" % line)
+            self.srcs.append([key, len(self.rule_offsets), 0])
+            self.prev_key = key
+        self.srcs[-1][2] += 1
+        self.rule_offsets.append(self.out.tell() - HEADER.size)
+        # Write the target columns and features
+        cols = trg.split(" |COL| ")
+        data = [COUNT.pack(len(cols))]
+        for col in cols:
+            ids = [self.intern(self.words, x) for x in col.split(" ")]
+            data.append(COUNT.pack(len(ids)))
+            data.append(struct.pack("<%dI" % len(ids), *ids))
+        feats = [x.split("=", 1) for x in feats.split(" ") if x]
+        data.append(COUNT.pack(len(feats)))
+        for name, val in feats:
+            data.append(FEAT.pack(self.intern(self.feats, name), float(val)))
+        self.out.write(b"".join(data))
+
+    # Write a table of strings as offsets followed by the UTF-8 strings
+    def write_strings(self, table):
+        strings = [x.encode("utf-8") for x in sorted(table, key=table.get)]
+        offsets = array("Q", [0])
+        for x in strings:
+            offsets.append(offsets[-1] + len(x))
+        self.out.write(to_le_bytes(offsets))
+        self.out.write(b"".join(strings))
+
+    # Write the index and vocabularies, and finish the file
+    def close(self):
+        offsets = [self.out.tell()]
+        self.out.write(to_le_bytes(self.rule_offsets))
+        offsets.append(self.out.tell())
+        key_offset = 0
+        for key, first_rule, num_rules in self.srcs:
+            self.out.write(SRC_ENTRY.pack(key_offset, len(key), first_rule, num_rules))
+            key_offset += len(key)
+        offsets.append(self.out.tell())
+        self.out.write(b"".join([x[0] for x in self.srcs]))
+        offsets.append(self.out.tell())
+        self.write_strings(self.words)
+        offsets.append(self.out.tell())
+        self.write_strings(self.feats)
+        offsets.append(self.out.tell())
+        self.out.seek(0)
+        self.out.write(HEADER.pack(MAGIC, VERSION, len(self.words), len(self.feats), len(self.srcs), len(self.rule_offsets), HEADER.size, *offsets))
+        self.out.close()
+
+class RuleTable(object):
+
+    # Reads a binary rule table through mmap, only decoding the parts that
+    # are looked up
+    def __init__(self, filename):
+        self.file = open(filename, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self.data, 0)
+        if header[0] != MAGIC or header[1] != VERSION:
+            raise Exception("%s is not a binary rule table" % filename)
+        self.num_words, self.num_feats, self.num_srcs, self.num_rules = header[2:6]
+        self.rules_start, self.offsets_start, self.index_start, self.keys_start, self.words_start, self.feats_start = header[6:12]
+        # Caches of decoded strings
+        self.words = {}
+        self.feats = {}
+
+    # Get a string from a table written by write_strings
+    def get_string(self, start, num, idx, cache):
+        ret = cache.get(idx)
+        if ret is None:
+            left, right = struct.unpack_from("<QQ", self.data, start + 8*idx)
+            blob = start + 8*(num+1)
+            ret = cache[idx] = self.data[blob+left:blob+right].decode("utf-8")
+        return ret
+
+    # Get the UTF-8 src key of an entry in the src index
+    def get_key(self, idx):
+        key_offset, key_len, first_rule, num_rules = SRC_ENTRY.unpack_from(self.data, self.index_start + SRC_ENTRY.size*idx)
+        start = self.keys_start + key_offset
+        return self.data[start:start+key_len], first_rule, num_rules
+
+    # Read the target and features of a rule
+    def get_rule(self, idx):
+        pos = self.rules_start + struct.unpack_from("<Q", self.data, self.offsets_start + 8*idx)[0]
+        num_cols, = COUNT.unpack_from(self.data, pos)
+        pos += COUNT.size
+        cols = []
+        for i in range(num_cols):
+            num_ids, = COUNT.unpack_from(self.data, pos)
+            pos += COUNT.size
+            ids = struct.unpack_from("<%dI" % num_ids, self.data, pos)
+            pos += WORD.size * num_ids
+            cols.append(" ".join([self.get_string(self.words_start, self.num_words, x, self.words) for x in ids]))
+        num_feats, = COUNT.unpack_from(self.data, pos)
+        pos += COUNT.size
+        feats = []
+        for i in range(num_feats):
+            name, val = FEAT.unpack_from(self.data, pos)
+            pos += FEAT.size
+            feats.append((self.get_string(self.feats_start, self.num_feats, name, self.feats), val))
+        return " |COL| ".join(cols), feats
+
+    # Find all rules for a src side, as (trg, [(feat, value), ...]) pairs
+    def lookup(self, src):
+        key = (src+" ||| ").encode("utf-8")
+        # Binary search over the sorted src index
+        left, right = 0, self.num_srcs
+        while left < right:
+            mid = (left+right)//2
+            if self.get_key(mid)[0] < key:
+                left = mid+1
+            else:
+                right = mid
+        if left == self.num_srcs:
+            return []
+        found, first_rule, num_rules = self.get_key(left)
+        if found != key:
+            return []
+        return [self.get_rule(x) for x in range(first_rule, first_rule+num_rules)]
+
+    # Format a rule in the text format
+    def format_rule(self, src, trg, feats):
+        return "%s ||| %s ||| %s" % (src, trg, " ".join(["%s=%.15g" % x for x in feats]))
+
+    # Iterate over all rules in the text format
+    def iter_lines(self):
+        for idx in range(self.num_srcs):
+            key, first_rule, num_rules = self.get_key(idx)
+            src = key.decode("utf-8")[:-5]
+            for rule in range(first_rule, first_rule+num_rules):
+                yield self.format_rule(src, *self.get_rule(rule))
+
+    # Close the file
+    def close(self):
+        self.data.close()
+        self.file.close()
@@ -0,0 +1,30 @@
+#!/usr/bin/python3
+
+import re
+
+class SrcFilter(object):
+
+    # An index of the src n-grams in a test set, used to skip extracting
+    # rules whose src terminals can never match it
+    def __init__(self, max_len=5):
+        # Parameters
+        self.max_len = max_len
+        # The set of n-grams, as space-separated strings
+        self.ngrams = set()
+
+    # Add all n-grams of a sentence up to max_len
+    def add_sentence(self, words):
+        for i in range(len(words)):
+            for j in range(i+1, min(i+self.max_len, len(words))+1):
+                self.ngrams.add(' '.join(words[i:j]))
+
+    # Read a file with one sentence per line, split in the same way as
+    # RuleExtractor.parse_words
+    def read_file(self, filename):
+        with open(filename, "r") as src_file:
+            for line in src_file:
+                self.add_sentence(re.findall(r"[^ ]+", line.strip()))
+
+    # Return true if words[start:end] is in the test set
+    def contains(self, words, start, end):
+        return end-start <= self.max_len and ' '.join(words[start:end]) in self.ngrams
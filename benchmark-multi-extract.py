@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import CorpusGenerator
+import RuleExtractor
+import RuleRenderer
+
+################### Arguments ###################
+
+# Arguments
+parser = argparse.ArgumentParser(description='Benchmark rule extraction on a synthetic corpus, and compare against a baseline.')
+parser.add_argument('--sents', default=500, type=int, help='The number of sentences to generate')
+parser.add_argument('--seed', default=0, type=int, help='The random seed of the corpus')
+parser.add_argument('--min_len', default=5, type=int, help='The minimum source sentence length')
+parser.add_argument('--max_len', default=30, type=int, help='The maximum source sentence length')
+parser.add_argument('--num_trgs', default=2, type=int, help='The number of targets')
+parser.add_argument('--density', default=1.5, type=float, help='The average number of links of each aligned word')
+parser.add_argument('--null_rate', default=0.1, type=float, help='The probability that a source word is unaligned')
+parser.add_argument('--repeat', default=3, type=int, help='The number of times to run each benchmark, keeping the fastest')
+parser.add_argument('--workers', default=1, type=int, help='The number of workers for the end-to-end multi-extract.py run')
+parser.add_argument('--no_end_to_end', action='store_true', help='Skip the end-to-end multi-extract.py run')
+parser.add_argument('--output', default=None, type=str, help='Write the results as JSON to this file')
+parser.add_argument('--baseline', default=None, type=str, help='Compare against the results in this JSON file')
+parser.add_argument('--threshold', default=0.1, type=float, help='Report a regression when a time grows by more than this fraction of the baseline')
+args = parser.parse_args()
+
+MULTDIR = os.path.dirname(os.path.abspath(__file__))
+
+################## Benchmarks ###################
+
+# Run each stage of create_hiero_rules and rendering separately over the
+# corpus, returning the time of each stage and the number of rules
+def time_stages(extractor, corpus):
+    times = dict(parse=0.0, phrases=0.0, nulls=0.0, abstract=0.0, render=0.0)
+    num_rules = 0
+    for strs in corpus:
+        start = time.perf_counter()
+        words, aligns = extractor.parse_lines(strs)
+        parsed = time.perf_counter()
+        nonnull = extractor.create_nonnull(aligns)
+        holes = extractor.create_minimal_srcs(nonnull[0], len(words[0]))
+        for g in aligns:
+            holes = extractor.extract_phrases(holes, g)
+        extracted = time.perf_counter()
+        phrases = extractor.add_nulls(words, holes, nonnull)
+        nulled = time.perf_counter()
+        rules = extractor.abstract_phrases(phrases, holes)
+        abstracted = time.perf_counter()
+        renderer = RuleRenderer.RuleRenderer(words)
+        [renderer.create_rule_string(hiero, hcount) for hiero, hcount in rules]
+        rendered = time.perf_counter()
+        times["parse"] += parsed - start
+        times["phrases"] += extracted - parsed
+        times["nulls"] += nulled - extracted
+        times["abstract"] += abstracted - nulled
+        times["render"] += rendered - abstracted
+        num_rules += len(rules)
+    return times, num_rules
+
+# Run create_hiero_rules alone, returning the time
+def time_hiero_rules(extractor, corpus):
+    start = time.perf_counter()
+    for strs in corpus:
+        words, aligns = extractor.parse_lines(strs)
+        extractor.create_hiero_rules(words, aligns)
+    return time.perf_counter() - start
+
+# Run create_hiero_rules with rendering as done by multi-extract.py,
+# returning the time
+def time_rule_strings(extractor, corpus):
+    start = time.perf_counter()
+    for strs in corpus:
+        extractor.create_rule_strings(strs)
+    return time.perf_counter() - start
+
+# Run func(extractor, corpus) in a forked child, so the memory it uses is
+# measured on its own. Returns the result, the peak RSS of the child in KB,
+# and how much it grew over the RSS the child started with, which includes
+# the corpus
+def run_forked(func, extractor, corpus):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        status = 1
+        try:
+            start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            result = func(extractor, corpus)
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            with os.fdopen(write_fd, "w") as pipe:
+                json.dump([result, max_rss, max_rss-start_rss], pipe)
+            status = 0
+        finally:
+            os._exit(status)
+    os.close(write_fd)
+    with os.fdopen(read_fd, "r") as pipe:
+        output = pipe.read()
+    _, status = os.waitpid(pid, 0)
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise Exception("Failed to run the %s benchmark" % func.__name__)
+    return json.loads(output)
+
+# Run multi-extract.py on the corpus, returning the time and peak RSS in KB
+def time_end_to_end(filenames):
+    cmd = [sys.executable, "%s/multi-extract.py" % MULTDIR, "--workers", str(args.workers)] + filenames
+    with open(os.devnull, "w") as devnull:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, stdout=devnull, stderr=devnull)
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - start
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise Exception("Failed to run: %s" % " ".join(cmd))
+    return elapsed, usage.ru_maxrss
+
+# Compare the results against a baseline, returning true if nothing is
+# slower by more than the threshold
+def compare(results, baseline):
+    if results["params"] != baseline["params"]:
+        print("Warning: the baseline was run with different parameters: %s" % baseline["params"], file=sys.stderr)
+    ok = True
+    print("%-20s %10s %10s %8s" % ("benchmark", "baseline", "current", "ratio"))
+    for name, stats in results["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+        base_time, curr_time = baseline["benchmarks"][name]["time"], stats["time"]
+        ratio = curr_time / base_time if base_time > 0 else 1.0
+        status = ""
+        if ratio > 1 + args.threshold:
+            status = "REGRESSION"
+            ok = False
+        elif ratio < 1 - args.threshold:
+            status = "improved"
+        print("%-20s %10.3f %10.3f %8.2f %s" % (name, base_time, curr_time, ratio, status))
+    return ok
+
+################## Main Program ###################
+
+params = dict(sents=args.sents, seed=args.seed, min_len=args.min_len, max_len=args.max_len, num_trgs=args.num_trgs, density=args.density, null_rate=args.null_rate)
+generator = CorpusGenerator.CorpusGenerator(seed=args.seed, min_len=args.min_len, max_len=args.max_len, num_trgs=args.num_trgs, density=args.density, null_rate=args.null_rate)
+corpus = generator.create_corpus(args.sents)
+extractor = RuleExtractor.RuleExtractor(num_trgs=args.num_trgs)
+
+# Keep the fastest time and the highest peak RSS of each benchmark over the
+# repeats. Each benchmark runs in its own child, so its memory is not mixed
+# up with generating the corpus or the other benchmarks
+benchmarks = {}
+def add_run(name, elapsed, max_rss, rss_growth, rules=None):
+    stats = benchmarks.setdefault(name, {"time": elapsed, "max_rss_kb": 0, "rss_growth_kb": 0})
+    stats["time"] = min(stats["time"], elapsed)
+    stats["sents_per_sec"] = args.sents/max(stats["time"], 1e-9)
+    if rules is not None:
+        stats["rules_per_sec"] = rules/max(stats["time"], 1e-9)
+    stats["max_rss_kb"] = max(stats["max_rss_kb"], max_rss)
+    stats["rss_growth_kb"] = max(stats["rss_growth_kb"], rss_growth)
+num_rules = 0
+for i in range(args.repeat):
+    (stage_times, num_rules), max_rss, rss_growth = run_forked(time_stages, extractor, corpus)
+    # The stages run together in one child, so they share its peak RSS. The
+    # stages before abstraction make phrases, not rules
+    for name, elapsed in stage_times.items():
+        add_run(name, elapsed, max_rss, rss_growth, num_rules if name in ("abstract", "render") else None)
+    for name, func in (("create_hiero_rules", time_hiero_rules), ("create_rule_strings", time_rule_strings)):
+        elapsed, max_rss, rss_growth = run_forked(func, extractor, corpus)
+        add_run(name, elapsed, max_rss, rss_growth, num_rules)
+
+if not args.no_end_to_end:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filenames = generator.write_corpus(corpus, os.path.join(tmpdir, "corpus"))
+        runs = [time_end_to_end(filenames) for i in range(args.repeat)]
+    elapsed = min([x[0] for x in runs])
+    benchmarks["end_to_end"] = {"time": elapsed, "sents_per_sec": args.sents/elapsed, "rules_per_sec": num_rules/elapsed, "max_rss_kb": max([x[1] for x in runs])}
+
+results = {"params": params, "rules": num_rules, "benchmarks": benchmarks}
+for name, stats in benchmarks.items():
+    rules_per_sec = "%10.1f rules/sec" % stats["rules_per_sec"] if "rules_per_sec" in stats else " "*20
+    print("%-20s %8.3f sec %10.1f sents/sec %s %10d KB peak RSS" % (name, stats["time"], stats["sents_per_sec"], rules_per_sec, stats["max_rss_kb"]), file=sys.stderr)
+print("%d rules" % num_rules, file=sys.stderr)
+if args.output:
+    with open(args.output, "w") as out:
+        json.dump(results, out, indent=2)
+if args.baseline:
+    with open(args.baseline, "r") as base:
+        if not compare(results, json.load(base)):
+            sys.exit(1)
@@ -3,19 +3,43 @@
 import sys
 import re
 import gzip
+import argparse
+from collections import deque
+
+import DocReader
 
 CONF_THRESHOLD=0.5
 
-input_prefix = sys.argv[1]
-output_prefix = sys.argv[2]
-langs = sys.argv[3:]
+################### Arguments ###################
+
+# Arguments
+parser = argparse.ArgumentParser(description='Build the multi-parallel files from the groups on stdin found by extract-groups.py.')
+parser.add_argument('input_prefix', type=str, help='The directory with a subdirectory of text documents for each language')
+parser.add_argument('output_prefix', type=str, help='The prefix of the output files')
+parser.add_argument('langs', type=str, nargs='+', help='The languages to output')
+parser.add_argument('--gzip', action='store_true', help='Write gzipped output files')
+parser.add_argument('--cache_docs', default=100, type=int, help='The number of recently read documents to cache')
+parser.add_argument('--threads', default=4, type=int, help='The number of threads prefetching documents (0 to disable)')
+parser.add_argument('--prefetch', default=8, type=int, help='The number of upcoming groups to prefetch the documents of')
+parser.add_argument('--buffer_lines', default=10000, type=int, help='The number of output lines to buffer before writing')
+args = parser.parse_args()
+
+input_prefix = args.input_prefix
+output_prefix = args.output_prefix
+langs = args.langs
 lang_map = {}
 for idx, lang in enumerate(langs):
     lang_map[lang] = idx
 files = []
+def open_output(filename):
+    if args.gzip:
+        return gzip.open(filename+".gz", "wt")
+    return open(filename, "w", buffering=1<<20)
 for x in langs:
-    files.append(open("%s%s.txt" % (output_prefix, x), "w"))
-files.append(open("%s00conf.txt" % output_prefix, "w"))
+    files.append(open_output("%s%s.txt" % (output_prefix, x)))
+files.append(open_output("%s00conf.txt" % output_prefix))
+# The lines waiting to be written to each file
+buffers = [[] for x in files]
 
 # <s id="1">
 #  <chunk type="NP" id="c-1">
@@ -28,9 +52,9 @@ files.append(open("%s00conf.txt" % output_prefix, "w"))
 #   <w head="0" hun="NN" tree="NN" lem="item" pos="NNP" id="w2.1" deprel="null">Item</w>
 #   <w head="3" hun="CD" tree="CD" lem="@card@" pos="CD" id="w2.2" deprel="number">11</w>
 #  </chunk>
+doc_reader = DocReader.DocReader(max_docs=max(args.cache_docs, (args.prefetch+1)*len(langs)), threads=args.threads)
 def read_txt_lines(filename):
-    txt_file = open(filename, "r")
-    return [x.strip() for x in txt_file.readlines()]
+    return doc_reader.get(filename)
     # xml_file = gzip.open(filename, "rb")
     # words = []
     # for line in xml_file:
@@ -48,46 +72,72 @@ def read_txt_lines(filename):
     #                 words[-1].append(word)
     # return [" ".join(x) for x in words]
 
+# Write the buffered lines of each file
+def flush_buffers():
+    for out, buf in zip(files, buffers):
+        if buf:
+            out.write("\n".join(buf)+"\n")
+            del buf[:]
+
+# Read the groups of each document from stdin, yielding
+#  (path, skip, ranges, confs, goods)
+def read_groups(stream):
+    for line in stream:
+        match = re.match(r"en\/(.*)", line.strip())
+        if not match: raise Exception("bad file name: %s" % line)
+        path = match.group(1)
+        path = path.replace(".xml.gz", ".txt")
+        # print(path)
+        my_langs = stream.readline().strip().split("\t")
+        # Check if all languages are present for this file
+        skip = False
+        for idx, lang in enumerate(langs):
+            if not lang in my_langs:
+                skip = True
+                break
+        # Read in the rest
+        ranges = [[] for x in langs]
+        confs = []
+        goods = []
+        while True:
+            line = stream.readline().strip()
+            if not line: break
+            range_str, conf = line.split(" ||| ")
+            idvals = range_str.split("\t")
+            while len(idvals) < len(my_langs): idvals.append("")
+            good = 1
+            for idx, val in enumerate(idvals):
+                if my_langs[idx] in lang_map:
+                    span = val.split("-")
+                    ranges[lang_map[my_langs[idx]]].append(span)
+                    if len(span) != 2 or span[0] != span[1]:
+                        good = 0
+            conf = float(conf)
+            confs.append(conf)
+            goods.append(1 if conf >= CONF_THRESHOLD else 0)
+        yield path, skip, ranges, confs, goods
+
+# Read the groups ahead of the current one, prefetching the documents of
+# those that will be written
+def prefetch_groups(groups):
+    upcoming = deque()
+    for group in groups:
+        upcoming.append(group)
+        if not group[1]:
+            for lang in langs:
+                doc_reader.prefetch("%s/%s/%s" % (input_prefix, lang, group[0]))
+        if len(upcoming) > args.prefetch:
+            yield upcoming.popleft()
+    yield from upcoming
+
 processed_files = total_files = 0
-for line in sys.stdin:
+for path, skip, ranges, confs, goods in prefetch_groups(read_groups(sys.stdin)):
     total_files += 1
     if total_files % 10 == 0:
         sys.stdout.write("*" if total_files % 100 == 0 else ".")
         if total_files % 500 == 0: print(" %d" % total_files)
         else: sys.stdout.flush()
 
-    match = re.match(r"en\/(.*)", line.strip())
-    if not match: raise Exception("bad file name: %s" % line)
-    path = match.group(1)
-    path = path.replace(".xml.gz", ".txt")
-    # print(path)
-    my_langs = sys.stdin.readline().strip().split("\t")
-    # Check if all languages are present for this file
-    skip = False
-    for idx, lang in enumerate(langs):
-        if not lang in my_langs:
-            skip = True
-            break
-    # Read in the rest
-    ranges = [[] for x in langs]
-    confs = []
-    goods = []
-    while True:
-        line = sys.stdin.readline().strip()
-        if not line: break
-        range_str, conf = line.split(" ||| ")
-        idvals = range_str.split("\t")
-        while len(idvals) < len(my_langs): idvals.append("")
-        good = 1
-        for idx, val in enumerate(idvals):
-            if my_langs[idx] in lang_map:
-                span = val.split("-")
-                ranges[lang_map[my_langs[idx]]].append(span)
-                if len(span) != 2 or span[0] != span[1]:
-                    good = 0
-        conf = float(conf)
-        confs.append(conf)
-        goods.append(1 if conf >= CONF_THRESHOLD else 0)
     if skip:
         continue
     processed_files += 1
@@ -97,12 +147,19 @@ for line in sys.stdin:
         for i, span in enumerate(ranges[idx]):
             if goods[i]:
                 if len(span) != 2:
-                    print("", file=files[idx])
+                    buffers[idx].append("")
                 else:
-                    print(" ".join(doc_lines[int(span[0])-1:int(span[1])]), file=files[idx])
+                    buffers[idx].append(" ".join(doc_lines[int(span[0])-1:int(span[1])]))
     for i, conf in enumerate(confs):
         if goods[i]:
-            print(conf, file=files[-1])
+            buffers[-1].append(str(conf))
+    if len(buffers[-1]) >= args.buffer_lines:
+        flush_buffers()
 
+flush_buffers()
+for out in files:
+    out.close()
+doc_reader.close()
 print("DONE!")
 print ("%s/%s files processed" % (processed_files, total_files), file=sys.stderr)
+print ("%d documents read on demand, %d cached or prefetched" % (doc_reader.misses, doc_reader.hits), file=sys.stderr)
@@ -0,0 +1,39 @@
+#!/usr/bin/python3
+
+import argparse
+import bz2
+import gzip
+import os
+import sys
+
+import RuleCombiner
+
+################### Arguments ###################
+
+# Arguments
+parser = argparse.ArgumentParser(description='Combine the scored tables of a multi-target grammar into a single table.')
+parser.add_argument('tables', type=str, nargs='+', help='The tables in the order SRCTRG_ALL TRGSRC_ALL SRCTRG_0 TRGSRC_0 ...')
+parser.add_argument('--limit', default=20, type=int, help='The maximum number of rules to keep for each source')
+parser.add_argument('--limit_type', default="egfp", type=str, help='egfp: keep the top src->trg0/trg1/... pairs, 0egfp: keep the top trg0s with their single best remainder')
+args = parser.parse_args()
+
+# Sanity check
+if len(args.tables) % 2 != 0:
+    raise Exception("Must have an even number of tables, one src-trg and one trg-src table for the whole rule and each target")
+
+################## Main Program ###################
+
+# Open a table, reading gzipped or bzipped files directly
+def open_table(filename):
+    for ext in ("", ".gz", ".bz2"):
+        if os.path.exists(filename+ext):
+            filename += ext
+            break
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rt")
+    elif filename.endswith(".bz2"):
+        return bz2.open(filename, "rt")
+    return open(filename, "r")
+
+combiner = RuleCombiner.RuleCombiner(limit=args.limit, limit_type=args.limit_type)
+combiner.combine([open_table(x) for x in args.tables], sys.stdout)
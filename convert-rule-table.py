@@ -0,0 +1,37 @@
+#!/usr/bin/python3
+
+import argparse
+import gzip
+import sys
+
+import RuleTable
+
+################### Arguments ###################
+
+# Arguments
+parser = argparse.ArgumentParser(description='Convert a text rule table to the binary format, or back to text.')
+parser.add_argument('input', type=str, help='The input table (may be gzipped)')
+parser.add_argument('output', type=str, help='The output table (- for stdout when writing text)')
+parser.add_argument('--to_text', action='store_true', help='Convert a binary table back to the text format')
+args = parser.parse_args()
+
+################## Main Program ###################
+
+if args.to_text:
+    table = RuleTable.RuleTable(args.input)
+    if args.output == "-":
+        out = sys.stdout
+    elif args.output.endswith(".gz"):
+        out = gzip.open(args.output, "wt")
+    else:
+        out = open(args.output, "w")
+    for line in table.iter_lines():
+        out.write(line+"\n")
+    out.close()
+    table.close()
+else:
+    text = gzip.open(args.input, "rt") if args.input.endswith(".gz") else open(args.input, "r")
+    writer = RuleTable.RuleTableWriter(args.output)
+    for line in text:
+        writer.add(line)
+    writer.close()
@@ -2,81 +2,221 @@
 
 import sys
 import re
-import itertools
+import gzip
+import time
+import argparse
+import multiprocessing
+from bisect import bisect_left, bisect_right
 from collections import defaultdict
 
-# A dictionary with
-#  src: spans[file_name][0][sentence] = assigned_span
-#  trg: spans[file_name][1][lang][sentence] = english
-spans = defaultdict(lambda: (defaultdict(lambda: [9999999, -1]), defaultdict(lambda: []), defaultdict(lambda: 99999999)))
+################## Functions ###################
 
-for xmlname in sys.argv[1:]:
-    print("Reading file %s" % xmlname, file=sys.stderr)
-    # Match and open the xml file
+# Find whether en is the from (0) or to (1) side of a file and the language
+def parse_name(xmlname):
     match = re.search(r"en-(..).xml", xmlname)
     if match:
-        src_idx = 0
-        lang = match.group(1)
-    else:
-        match = re.search(r"(..)-en.xml", xmlname)
-        if not match:
-            raise Exception("Didn't match %s"%xmlname)
-        src_idx = 1
-        lang = match.group(1)
-    xmlfile = open(xmlname, "r")
+        return 0, match.group(1)
+    match = re.search(r"(..)-en.xml", xmlname)
+    if not match:
+        raise Exception("Didn't match %s"%xmlname)
+    return 1, match.group(1)
+
+# Open a link file, which may be gzipped
+def open_xml(xmlname):
+    if xmlname.endswith(".gz"):
+        return gzip.open(xmlname, "rt")
+    return open(xmlname, "r")
+
+LINKGRP_RE = re.compile(r" <linkGrp.*toDoc=\"(.*)\" fromDoc=\"(.*)\"")
+LINK_RE = re.compile(r"<link certainty=\"(.*)\" xtargets=\"([0-9 ]*);([0-9 ]*)\"")
+
+# Read the links of a file one document at a time, yielding
+#  (document_name, [(conf, src_arr, trg_arr), ...])
+# where document_name is the en document. Every progress lines (0 to
+# disable) the throughput is printed
+def read_docs(xmlname, progress=0):
+    print("Reading file %s" % xmlname, file=sys.stderr)
+    src_idx, lang = parse_name(xmlname)
     currname = ""
-    lineno = 0
+    links = []
+    # Throughput counters
+    start = time.time()
+    lineno, num_chars, num_docs = 0, 0, 0
     # Grab the spans from every line
-    for line in xmlfile:
-        match = re.match(r" <linkGrp.*toDoc=\"(.*)\" fromDoc=\"(.*)\"", line)
-        if match:
-            currname = match.group(2-src_idx)
-        else:
-            match = re.match(r"<link certainty=\"(.*)\" xtargets=\"([0-9 ]*);([0-9 ]*)\"", line)
-            if match and match.group(src_idx+2):
-                # Find the src
-                src_arr = [int(x) for x in match.group(src_idx+2).split(" ")]
-                src_min = min(src_arr)
-                src_max = max(src_arr)
-                curr_spans0, curr_spans1, confs = spans[currname]
-                conf = float(match.group(1))
-                for src in src_arr:
-                    confs[src] = min(confs[src], conf)
-                    curr_spans0[src] = (min(src_min, curr_spans0[src][0]),
-                                        max(src_max, curr_spans0[src][1]))
-                if match.group(3-src_idx):
-                    # Create the target range
-                    trg_arr = [int(x) for x in match.group(3-src_idx).split(" ")]
-                    trg_range = (min(trg_arr), max(trg_arr))
-                    curr_spans1[lang].append( (trg_range, src_min) )
-        # Print progress
-        lineno += 1
-        if lineno % 1000000 == 0:
-            sys.stderr.write("*")
-            sys.stderr.flush()
-        elif lineno % 100000 == 0:
-            sys.stderr.write(".")
-            sys.stderr.flush()
-    print("DONE!", file=sys.stderr)
+    with open_xml(xmlname) as xmlfile:
+        for line in xmlfile:
+            if line.startswith(" <linkGrp"):
+                match = LINKGRP_RE.match(line)
+                if match:
+                    if links:
+                        yield currname, links
+                    currname = match.group(2-src_idx)
+                    links = []
+                    num_docs += 1
+            elif line.startswith("<link "):
+                match = LINK_RE.match(line)
+                if match and match.group(src_idx+2):
+                    src_arr = [int(x) for x in match.group(src_idx+2).split(" ")]
+                    trg_arr = [int(x) for x in match.group(3-src_idx).split(" ")] if match.group(3-src_idx) else None
+                    links.append( (float(match.group(1)), src_arr, trg_arr) )
+            # Print progress
+            lineno += 1
+            num_chars += len(line)
+            if progress and lineno % progress == 0:
+                print_throughput(xmlname, lineno, num_chars, num_docs, time.time()-start)
+    if links:
+        yield currname, links
+    print_throughput(xmlname, lineno, num_chars, num_docs, time.time()-start, done=True)
+
+# Print the throughput of reading a file
+def print_throughput(xmlname, lineno, num_chars, num_docs, elapsed, done=False):
+    elapsed = max(elapsed, 1e-6)
+    print("%s %s: %d lines, %d documents, %.1f MB in %.1f sec (%.0f lines/sec, %.1f MB/sec)" %
+          ("Finished" if done else "Reading", xmlname, lineno, num_docs, num_chars/1e6, elapsed, lineno/elapsed, num_chars/1e6/elapsed), file=sys.stderr)
+    sys.stderr.flush()
+
+# Parse a file in a worker process, sending the documents in batches
+def parse_worker(xmlname, queue, progress):
+    try:
+        batch = []
+        for doc in read_docs(xmlname, progress):
+            batch.append(doc)
+            if len(batch) == 100:
+                queue.put(batch)
+                batch = []
+        queue.put(batch)
+        queue.put(None)
+    except Exception as e:
+        queue.put(e)
+        raise
+
+# Read the documents of a file parsed by a worker process
+def read_worker_docs(queue):
+    while True:
+        batch = queue.get()
+        if batch is None:
+            return
+        if isinstance(batch, Exception):
+            raise batch
+        yield from batch
+
+# Start a worker process for each file, returning a reader for each. When
+# reading unsorted files the workers parse everything without waiting
+def start_workers(xmlnames, unsorted=False, progress=0):
+    # Fork like multi-extract.py, so the workers don't re-import this script
+    context = multiprocessing.get_context("fork")
+    readers = []
+    for xmlname in xmlnames:
+        queue = context.Queue(maxsize=0 if unsorted else 64)
+        proc = context.Process(target=parse_worker, args=(xmlname, queue, progress), daemon=True)
+        proc.start()
+        readers.append(read_worker_docs(queue))
+    return readers
 
+# A tuple with
+#  src: doc_spans[0][sentence] = assigned_span
+#  trg: doc_spans[1][lang] = [(trg_range, src_min), ...]
+#  conf: doc_spans[2][sentence] = minimum confidence
+def new_doc_spans():
+    return (defaultdict(lambda: [9999999, -1]), defaultdict(lambda: []), defaultdict(lambda: 99999999))
+
+# Add the links of one document in one language to its spans
+def add_links(doc_spans, lang, links):
+    curr_spans0, curr_spans1, confs = doc_spans
+    for conf, src_arr, trg_arr in links:
+        # Find the src
+        src_min = min(src_arr)
+        src_max = max(src_arr)
+        for src in src_arr:
+            confs[src] = min(confs[src], conf)
+            curr_spans0[src] = (min(src_min, curr_spans0[src][0]),
+                                max(src_max, curr_spans0[src][1]))
+        if trg_arr:
+            # Create the target range
+            trg_range = (min(trg_arr), max(trg_arr))
+            curr_spans1[lang].append( (trg_range, src_min) )
+
+# Find the nodes a node reaches in the graph of expand_links. Nodes n to 2n-1
+# are the sentences, which reach the nodes covering the sentences inside their
+# spans, and each node v < n reaches nodes 2v and 2v+1 like a segment tree
+def span_children(v, n, keys, spans):
+    if v < n:
+        return [2*v, 2*v+1]
+    left = bisect_left(keys, spans[v][0]) + n
+    right = bisect_right(keys, spans[v][1]) + n
+    children = []
+    while left < right:
+        if left & 1:
+            children.append(left)
+            left += 1
+        if right & 1:
+            right -= 1
+            children.append(right)
+        left, right = left >> 1, right >> 1
+    return children
 
 # Given a dictionary of sentences and the spans, expand the spans until they no
-# longer contradict
+# longer contradict. Each span grows to the smallest span that contains the
+# original spans of all sentences inside it, which is the same fixpoint as
+# repeatedly expanding all spans. A sentence reaches the sentences inside its
+# span, so its final span covers the spans of all sentences it reaches. These
+# are found with Tarjan's algorithm, where each strongly connected component
+# gets one span from the spans of its members and the components they reach,
+# which are already finished. A segment tree over the sorted sentences turns
+# each span into O(log n) edges, so this takes O(n log n) time
 def expand_links(links):
-    span_len = -1
-    next_len = sum([y[1]-y[0] for x, y in links.items()])
-    while next_len != span_len:
-        span_len = next_len
-        for x, y in links.items():
-            my_spans = [links[x] for x in range(y[0], y[1]+1) if x in links]
-            links[x] = (min([x[0] for x in my_spans]),
-                        max([x[1] for x in my_spans]))
-        next_len = sum([y[1]-y[0] for x, y in links.items()])
-
-
-print("Found %d files! Printing file by file." % len(spans), file=sys.stderr)
-# Create the mapping
-for filename, (src_links, trg_links, confs) in spans.items():
+    keys = sorted(links)
+    n = len(keys)
+    spans = [(9999999, -1)]*n + [links[x] for x in keys]
+    # The DFS number and lowest reachable DFS number of each node, and the
+    # span of everything it reaches, which is final once the node's component
+    # is finished
+    index, low = [0]*(2*n), [0]*(2*n)
+    lefts, rights = [x[0] for x in spans], [x[1] for x in spans]
+    finished = [False]*(2*n)
+    component = []
+    counter = 0
+    for root in range(n, 2*n):
+        if index[root]:
+            continue
+        counter += 1
+        index[root] = low[root] = counter
+        component.append(root)
+        work = [(root, iter(span_children(root, n, keys, spans)))]
+        while work:
+            v, children = work[-1]
+            for w in children:
+                if not index[w]:
+                    counter += 1
+                    index[w] = low[w] = counter
+                    component.append(w)
+                    work.append((w, iter(span_children(w, n, keys, spans))))
+                    break
+                elif finished[w]:
+                    lefts[v], rights[v] = min(lefts[v], lefts[w]), max(rights[v], rights[w])
+                else:
+                    low[v] = min(low[v], index[w])
+            else:
+                work.pop()
+                if low[v] == index[v]:
+                    # Pop the component, whose members all get the span of v
+                    while True:
+                        w = component.pop()
+                        finished[w] = True
+                        lefts[w], rights[w] = lefts[v], rights[v]
+                        if w == v:
+                            break
+                if work:
+                    # The parent reaches everything v reaches
+                    u = work[-1][0]
+                    low[u] = min(low[u], low[v])
+                    lefts[u], rights[u] = min(lefts[u], lefts[v]), max(rights[u], rights[v])
+    for i, x in enumerate(keys):
+        links[x] = (lefts[n+i], rights[n+i])
+
+# Expand the links of a document and print its blocks
+def print_doc(filename, doc_spans):
+    src_links, trg_links, confs = doc_spans
     # Expand the links
     expand_links(src_links)
     # The things we want to make
@@ -109,3 +249,50 @@ for filename, (src_links, trg_links, confs) in spans.items():
     for i in range(len(block_ranges[0])):
         print("%s ||| %f" % ("\t".join([("%d-%d" % (x[i][0], x[i][1]) if (i in x) else "") for x in block_ranges]), my_confs[i]))
     print("")
+
+################## Main Program ###################
+
+def main():
+    # Arguments
+    parser = argparse.ArgumentParser(description='Find groups of aligned sentences over several en-xx or xx-en link files.')
+    parser.add_argument('xmlfiles', type=str, nargs='+', help='The link files, one for each language')
+    parser.add_argument('--unsorted', action='store_true', help='The documents in the link files are not sorted by name, so read everything before printing')
+    parser.add_argument('--workers', default=1, type=int, help='Parse each link file in its own worker process if more than 1')
+    parser.add_argument('--progress', default=1000000, type=int, help='Report the throughput of each file every this many lines (0 to disable)')
+    args = parser.parse_args()
+
+    langs = [parse_name(x)[1] for x in args.xmlfiles]
+    if args.workers > 1:
+        readers = start_workers(args.xmlfiles, args.unsorted, args.progress)
+    else:
+        readers = [read_docs(x, args.progress) for x in args.xmlfiles]
+    if args.unsorted:
+        # Read every file before printing anything
+        spans = defaultdict(new_doc_spans)
+        for reader, lang in zip(readers, langs):
+            for filename, links in reader:
+                add_links(spans[filename], lang, links)
+        print("DONE!", file=sys.stderr)
+        print("Found %d files! Printing file by file." % len(spans), file=sys.stderr)
+        for filename, doc_spans in spans.items():
+            print_doc(filename, doc_spans)
+    else:
+        # Read all files in parallel, merging by document name, and print each
+        # document once it has been read from every file
+        heads = [next(x, None) for x in readers]
+        num_docs = 0
+        while any(heads):
+            filename = min([x[0] for x in heads if x])
+            doc_spans = new_doc_spans()
+            for i, lang in enumerate(langs):
+                while heads[i] and heads[i][0] == filename:
+                    add_links(doc_spans, lang, heads[i][1])
+                    heads[i] = next(readers[i], None)
+                    if heads[i] and heads[i][0] < filename:
+                        raise Exception("Documents in %s are not sorted by name at %s, use --unsorted" % (args.xmlfiles[i], heads[i][0]))
+            print_doc(filename, doc_spans)
+            num_docs += 1
+        print("DONE! Printed %d files." % num_docs, file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
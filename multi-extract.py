@@ -2,9 +2,20 @@
 
 import itertools
 import argparse
+import multiprocessing
+import os
+import shutil
 import sys
+import tempfile
+import time
 
 import RuleExtractor
+import RuleAggregator
+import RuleCache
+import SrcFilter
+import ExtractStats
+import BackgroundIO
+import RuleStore
 
 ################### Arguments ###################
 
@@ -17,6 +28,27 @@ parser.add_argument('--max_sym_src', default=5, type=int, help='The maximum numb
 parser.add_argument('--max_sym_trg', default=999, type=int, help='The maximum number of target words')
 parser.add_argument('--max_nonterm', default=2, type=int, help='The maximum number of non-terms')
 parser.add_argument('--min_src_interceding', default=1, type=int, help='Minimum number of terminals between non-terms in the source')
+parser.add_argument('--norm_kept', action='store_true', help='Divide the count of each phrase over only the rules that pass the symbol limits')
+parser.add_argument('--filter_src', default=None, type=str, help='Only extract rules whose source terminals all appear in this test set')
+parser.add_argument('--max_phrases', default=0, type=int, help='The maximum number of phrases with nulls added in a sentence (0 for no limit)')
+parser.add_argument('--max_rules', default=0, type=int, help='The maximum number of rules enumerated from a sentence (0 for no limit)')
+parser.add_argument('--max_time', default=0, type=float, help='The maximum number of seconds to spend on a sentence, after which it is skipped (0 for no limit)')
+parser.add_argument('--budget_action', default="degrade", choices=["degrade", "skip"], help='For sentences over --max_phrases or --max_rules, either stop adding nulls and lower max_nonterm until they fit, or skip them')
+parser.add_argument('--cache_sents', default=0, type=int, help='The number of sentences to cache the rules of, so repeated sentences are not re-extracted (0 to disable). Each worker keeps its own cache')
+parser.add_argument('--cache_rules', default=500000, type=int, help='The maximum total number of rules to cache')
+parser.add_argument('--cache_sent_rules', default=2000, type=int, help='Only cache sentences with at most this many rules')
+parser.add_argument('--workers', default=1, type=int, help='The number of worker processes to use for extraction')
+parser.add_argument('--chunk_size', default=1000, type=int, help='The number of sentences sent to a worker at a time')
+parser.add_argument('--unordered', action='store_true', help='With --workers, write the chunks in the order they finish instead of the input order')
+parser.add_argument('--buffer_lines', default=10000, type=int, help='The number of rules to buffer before writing them out')
+parser.add_argument('--aggregate', action='store_true', help='Sum the counts of identical rules and output them sorted')
+parser.add_argument('--aggregate_mem', default=1024, type=int, help='With --aggregate, the memory in MB to use before spilling sorted runs to disk')
+parser.add_argument('--store', default=None, type=str, help='Keep the aggregated counts in this directory with a record of the lines extracted, and only extract the lines added to the inputs since the last run. Implies --aggregate, and outputs the merged counts')
+parser.add_argument('--tmpdir', default=None, type=str, help='The directory to write temporary files to')
+parser.add_argument('--output', default=None, type=str, help='Write the rules to this file instead of stdout, gzipped if it ends in .gz')
+parser.add_argument('--stats', default=None, type=str, help='Time each stage of extraction and write the statistics to this JSON file')
+parser.add_argument('--stats_top_k', default=10, type=int, help='With --stats, the number of slowest sentences to record')
+parser.add_argument('--progress', default=100000, type=int, help='Report the throughput every this many sentences (0 to disable)')
 # parser.add_argument('--min_words_src', type=int, help='')
 # parser.add_argument('--allow_only_unaligned', type=bool, help='')
 args = parser.parse_args()
@@ -28,24 +60,193 @@ num_trgs = int(len(args.trgs)/2)
 
 print(args, file=sys.stderr)
 
+################## Worker Functions ###################
+
+# The extractor and cache used by each worker process, and the directory
+# the rules of each chunk are written to
+worker_extractor = None
+worker_cache = None
+worker_top_k = None
+worker_spill_dir = None
+
+def init_worker(params, cache_params, stats_top_k, spill_dir):
+    global worker_extractor, worker_cache, worker_top_k, worker_spill_dir
+    worker_extractor = RuleExtractor.RuleExtractor(**params)
+    worker_cache = RuleCache.RuleCache(**cache_params) if cache_params else None
+    worker_top_k = stats_top_k
+    worker_spill_dir = spill_dir
+
+# Extract the rules for a chunk of lines starting at line number lineno,
+# writing them to a file as they are made so neither the worker nor the
+# main process holds the rules of a whole chunk. Return the file name and
+# number of rules, timing, the number of cache hits and misses, and the
+# statistics of the chunk if they are being collected
+def extract_chunk(lineno_chunk):
+    lineno, chunk = lineno_chunk
+    start = time.time()
+    hits, misses = (worker_cache.hits, worker_cache.misses) if worker_cache else (0, 0)
+    if worker_top_k is not None:
+        worker_extractor.stats = ExtractStats.ExtractStats(worker_top_k)
+    fd, out_name = tempfile.mkstemp(suffix=".txt", dir=worker_spill_dir)
+    num_rules = 0
+    with os.fdopen(fd, "w") as out:
+        for i, strs in enumerate(chunk):
+            for rule_str in worker_extractor.iter_rule_strings(strs, worker_cache, lineno+i):
+                out.write(rule_str+"\n")
+                num_rules += 1
+    if worker_cache:
+        hits, misses = worker_cache.hits-hits, worker_cache.misses-misses
+    return os.getpid(), len(chunk), time.time()-start, out_name, num_rules, hits, misses, worker_extractor.stats
+
+# Split the lines into chunks of a fixed size, with the line number each
+# chunk starts at
+def make_chunks(lines, size, lineno=1):
+    while True:
+        chunk = list(itertools.islice(lines, size))
+        if not chunk:
+            break
+        yield lineno, chunk
+        lineno += len(chunk)
+
 ################## Main Program ###################
 
-# Get handles to all files
-files = [open(args.src, "r")]
-for trg in args.trgs:
-    files.append(open(trg, "r"))
+# Index the test set to filter by
+src_filter = None
+if args.filter_src:
+    src_filter = SrcFilter.SrcFilter(max_len=args.max_sym_src)
+    src_filter.read_file(args.filter_src)
 
 # Create the extractor
-extractor = RuleExtractor.RuleExtractor(max_span=args.max_span, max_sym_src=args.max_sym_src, max_sym_trg=args.max_sym_trg, max_nonterm=args.max_nonterm, min_src_interceding=args.min_src_interceding, num_trgs=num_trgs)
-
-# Process every line
-for strs in zip(*files):
-    strs = [x.strip() for x in strs]
-    # Parse the values
-    words = [extractor.parse_words(strs[0])]
-    for x in strs[1::2]:
-        words.append(extractor.parse_words(x))
-    aligns = [ extractor.parse_align(x) for x in strs[2::2] ]
-    hiero_rules = extractor.create_hiero_rules(words, aligns)
-    for hiero, hcount in hiero_rules:
-        print(extractor.create_rule_string(words, hiero, hcount))
+params = dict(max_span=args.max_span, max_sym_src=args.max_sym_src, max_sym_trg=args.max_sym_trg, max_nonterm=args.max_nonterm, min_src_interceding=args.min_src_interceding, num_trgs=num_trgs, norm_kept=args.norm_kept, src_filter=src_filter, max_phrases=args.max_phrases, max_rules=args.max_rules, max_time=args.max_time, budget_action=args.budget_action)
+extractor = RuleExtractor.RuleExtractor(**params)
+stats_top_k = args.stats_top_k if args.stats else None
+stats = ExtractStats.ExtractStats(stats_top_k) if args.stats else None
+extractor.stats = stats
+
+# Get handles to all files, which may be gzipped. With a store, only read the
+# lines added since the last run
+filenames = [args.src] + args.trgs
+store = None
+first_line = 1
+if args.store:
+    store_params = dict([(k, v) for k, v in params.items() if k != "src_filter"], filter_src=args.filter_src)
+    store = RuleStore.RuleStore(args.store)
+    store.check(store_params, filenames)
+    files = store.open_files(filenames)
+    first_line = store.start_line()+1
+else:
+    files = [BackgroundIO.open_text(x) for x in filenames]
+
+cache_params = dict(max_sents=args.cache_sents, max_rules=args.cache_rules, max_sent_rules=args.cache_sent_rules) if args.cache_sents > 0 else None
+cache_hits = cache_misses = 0
+
+# Either buffer the rules to be written in large blocks, or add them to the
+# aggregator, one at a time as they are made. Returns the number of rules
+aggregator = RuleAggregator.RuleAggregator(max_mem=args.aggregate_mem, tmpdir=args.tmpdir) if args.aggregate or store else None
+out_buffer = []
+def output_rules(rule_strs):
+    num = 0
+    if aggregator:
+        for rule_str in rule_strs:
+            aggregator.add(rule_str)
+            num += 1
+    else:
+        for rule_str in rule_strs:
+            out_buffer.append(rule_str)
+            num += 1
+            if len(out_buffer) >= args.buffer_lines:
+                flush_rules()
+    return num
+def flush_rules():
+    if out_buffer:
+        writer.write("\n".join(out_buffer)+"\n")
+        del out_buffer[:]
+
+# Report the throughput each time another args.progress sentences are done
+start_time = time.time()
+num_sents = num_rules = 0
+def report_progress(sents, rules):
+    global num_sents, num_rules
+    prev_sents = num_sents
+    num_sents += sents
+    num_rules += rules
+    if args.progress > 0 and num_sents // args.progress != prev_sents // args.progress:
+        elapsed = max(time.time()-start_time, 1e-9)
+        print("Processed %d sentences, %d rules in %.1f sec (%.1f sentences/sec, %.1f rules/sec)" % (num_sents, num_rules, elapsed, num_sents/elapsed, num_rules/elapsed), file=sys.stderr)
+
+# Start the pool of workers before any threads, so they can be forked safely.
+# Use fork so the workers don't re-run this script. The workers write the
+# rules of each chunk to a file in spill_dir, which is always removed
+spill_dir = None
+if args.workers > 1:
+    spill_dir = tempfile.mkdtemp(prefix="multi-extract.", dir=args.tmpdir)
+    pool = multiprocessing.get_context("fork").Pool(args.workers, init_worker, (params, cache_params, stats_top_k, spill_dir))
+
+# Read and decompress the input, and compress and write the output, in
+# background threads while extracting
+lines = BackgroundIO.BackgroundReader(zip(*files))
+out_file = BackgroundIO.open_text(args.output, "w") if args.output else sys.stdout
+writer = BackgroundIO.BackgroundWriter(out_file)
+
+# Always remove the aggregator's spilled runs and the chunk files, even if
+# extraction fails
+try:
+    if args.workers <= 1:
+        # Process every line
+        cache = RuleCache.RuleCache(**cache_params) if cache_params else None
+        for lineno, strs in enumerate(lines, first_line):
+            report_progress(1, output_rules(extractor.iter_rule_strings(strs, cache, lineno)))
+        if cache:
+            cache_hits, cache_misses = cache.hits, cache.misses
+    else:
+        # Process chunks of lines in the pool of workers
+        mapper = pool.imap_unordered if args.unordered else pool.imap
+        worker_stats = {}
+        for pid, chunk_sents, elapsed, out_name, chunk_rules, hits, misses, chunk_stats in mapper(extract_chunk, make_chunks(iter(lines), args.chunk_size, first_line)):
+            with open(out_name, "r") as out:
+                output_rules(line[:-1] for line in out)
+            os.remove(out_name)
+            report_progress(chunk_sents, chunk_rules)
+            cache_hits += hits
+            cache_misses += misses
+            if stats:
+                stats.merge(chunk_stats)
+            pid_stats = worker_stats.setdefault(pid, [0, 0.0])
+            pid_stats[0] += chunk_sents
+            pid_stats[1] += elapsed
+        pool.close()
+        pool.join()
+        # Report the throughput of each worker
+        for pid, (pid_sents, elapsed) in sorted(worker_stats.items()):
+            print("Worker %d: %d sentences in %.2f sec (%.1f sentences/sec)" % (pid, pid_sents, elapsed, pid_sents/elapsed if elapsed > 0 else 0.0), file=sys.stderr)
+
+    # Report the cache statistics
+    if cache_params:
+        print("Sentence cache: %d hits, %d misses (%.1f%% hit rate)" % (cache_hits, cache_misses, 100.0*cache_hits/max(cache_hits+cache_misses, 1)), file=sys.stderr)
+
+    # Write the remaining or aggregated rules
+    flush_rules()
+    if aggregator:
+        if store:
+            # Merge the new counts with those in the store, writing both the
+            # output and the new counts of the store
+            if store.counts_file():
+                aggregator.add_run(store.counts_file())
+            with store.open_counts() as counts:
+                aggregator.write(writer, counts)
+        else:
+            aggregator.write(writer)
+finally:
+    if aggregator:
+        aggregator.close()
+    if spill_dir:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+writer.close()
+if args.output:
+    out_file.close()
+if store:
+    store.commit(store_params, filenames)
+
+# Write the extraction statistics
+if stats:
+    stats.write(args.stats)
@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+
+import argparse
+import gzip
+import itertools
+import sys
+
+import RuleAggregator
+import RuleScorer
+
+################### Arguments ###################
+
+# Arguments
+parser = argparse.ArgumentParser(description='Score the combined table and every target factor of an extracted multi-target grammar in a single pass.')
+parser.add_argument('extract', type=str, help='The output of multi-extract.py (may be gzipped, - for stdin)')
+parser.add_argument('out_prefix', type=str, help='Write tables to OUT_PREFIX.{src-trg,trg-src}.{all,0,1,...}.gz')
+parser.add_argument('--trg_given_src', type=str, nargs='*', default=[], help='A lexical probability file for each target factor')
+parser.add_argument('--src_given_trg', type=str, nargs='*', default=[], help='A reverse lexical probability file for each target factor')
+parser.add_argument('--sorted', action='store_true', help='The input is already sorted, for example from multi-extract.py --aggregate')
+parser.add_argument('--mem', default=1024, type=int, help='The memory in MB to use for sorting and for the target counts before spilling to disk')
+parser.add_argument('--tmpdir', default=None, type=str, help='The directory to write temporary files to')
+args = parser.parse_args()
+
+# Sanity check
+if len(args.trg_given_src) != len(args.src_given_trg):
+    raise Exception("Must have the same number of --trg_given_src and --src_given_trg files")
+
+print(args, file=sys.stderr)
+
+################## Main Program ###################
+
+# Open an input file, reading gzipped files directly
+def open_input(filename):
+    if filename == "-":
+        return sys.stdin
+    elif filename.endswith(".gz"):
+        return gzip.open(filename, "rt")
+    return open(filename, "r")
+
+# Split a line "src ||| trg ||| count" into a key and count
+def split_line(line):
+    split = line.rindex(" ||| ") + 5
+    return line[:split], float(line[split:])
+
+# Read the rule counts, sorting them unless they are already sorted. Always
+# remove the aggregator's spilled runs, even if scoring fails
+aggregator = None
+try:
+    extract = open_input(args.extract)
+    if args.sorted:
+        items = (split_line(line) for line in extract)
+    else:
+        aggregator = RuleAggregator.RuleAggregator(max_mem=args.mem, tmpdir=args.tmpdir)
+        for line in extract:
+            aggregator.add(line)
+        items = aggregator.items()
+
+    # Find the number of targets from the first rule
+    first = next(items, None)
+    if first is None:
+        raise Exception("No rules found in %s" % args.extract)
+    num_trgs = first[0].split(" ||| ")[1].count(" |COL| ") + 1
+    if args.trg_given_src and len(args.trg_given_src) != num_trgs:
+        raise Exception("Found %d targets but %d lexical probability files" % (num_trgs, len(args.trg_given_src)))
+    lex_probs = [(RuleScorer.read_lex_probs(x), RuleScorer.read_lex_probs(y)) for x, y in zip(args.trg_given_src, args.src_given_trg)]
+
+    # Open the tables and score
+    names = ["all"] + [str(x) for x in range(num_trgs)]
+    egf_outs = [gzip.open("%s.src-trg.%s.gz" % (args.out_prefix, x), "wt") for x in names]
+    fge_outs = [gzip.open("%s.trg-src.%s.gz" % (args.out_prefix, x), "wt") for x in names]
+    scorer = RuleScorer.RuleScorer(num_trgs, lex_probs=lex_probs, tmpdir=args.tmpdir, max_mem=args.mem)
+    scorer.score(itertools.chain([first], items), egf_outs, fge_outs)
+    for out in egf_outs + fge_outs:
+        out.close()
+finally:
+    if aggregator:
+        aggregator.close()
@@ -1,7 +1,32 @@
 #!/usr/bin/python
 
 import unittest
+import math
+import io
 import RuleExtractor
+import RuleAggregator
+import RuleRenderer
+import RuleCache
+import RuleScorer
+import RuleCombiner
+import Pipeline
+import SrcFilter
+import RuleTable
+import DocReader
+import CorpusGenerator
+import ExtractStats
+import BackgroundIO
+import RuleStore
+import os
+import tempfile
+import time
+import gzip
+import random
+import subprocess
+import sys
+import importlib.util
+
+MULTDIR = os.path.dirname(os.path.abspath(__file__))
 
 class TestRuleExtractor(unittest.TestCase):
 
@@ -24,6 +49,14 @@ class TestRuleExtractor(unittest.TestCase):
         act_sent = self.default.parse_align(in_str)
         self.assertEqual(act_sent, exp_sent)
 
+    def test_parse_lines(self):
+        in_strs = ["a b\n", "c d e\n", "0-0 1-2\n", "f\n", "\n"]
+        exp_words = [["a", "b"], ["c", "d", "e"], ["f"]]
+        exp_aligns = [[(0,0), (1,2)], []]
+        act_words, act_aligns = self.default.parse_lines(in_strs)
+        self.assertEqual(act_words, exp_words)
+        self.assertEqual(act_aligns, exp_aligns)
+
     def test_nonnull(self):
         exp_nonnull = [set((0,2,3,4,5)), set((0,1,2,3,4))]
         act_nonnull = self.default.create_nonnull( [self.taro_a] )
@@ -40,6 +73,19 @@ class TestRuleExtractor(unittest.TestCase):
         act_phrases = self.default.extract_phrases(candidates, self.taro_a)
         self.assertEqual(act_phrases, exp_phrases)
     
+    def test_range_table(self):
+        vals = [3, 1, 4, 1, 5, 9, 2]
+        table = self.default.build_range_table(vals, min)
+        self.assertEqual(table[0], vals)
+        self.assertEqual(table[1], [1, 1, 1, 1, 5, 2])
+        self.assertEqual(table[2], [1, 1, 1, 1])
+
+    def test_extract_phrases_unaligned(self):
+        candidates = [[(0,1)], [(0,2)], [(1,2)]]
+        exp_phrases = [[(0,1), (1,2)], [(0,2), (1,2)]]
+        act_phrases = self.default.extract_phrases(candidates, [(0,1)])
+        self.assertEqual(act_phrases, exp_phrases)
+
     def test_phrase_string(self):
         holes = [(2,4), (1,2)]
         exp_phrase = "\"he\" x1:X x0:X \"taro\" @ X"
@@ -58,5 +104,601 @@ class TestRuleExtractor(unittest.TestCase):
         act_phrases = self.default.add_nulls([self.taro_f, self.taro_e], holes, [set((0,2,3,4,5)), set((0,1,2,3,4))])
         self.assertEqual(act_phrases, exp_phrases)
 
+    def test_abstract_phrases(self):
+        holes = [[(0,1), (0,1)], [(0,6), (0,5)], [(2,3), (4,5)], [(2,6), (1,5)], [(3,6), (1,4)], [(4,5), (2,3)]]
+        extractor = RuleExtractor.RuleExtractor(max_sym_src=999)
+        act_rules = extractor.abstract_phrases(holes, holes)
+        self.assertEqual(len(act_rules), 21)
+        self.assertEqual(act_rules[2], (([(0,6), (0,5)], [(0,1), (0,1)]), 1.0/11))
+        self.assertAlmostEqual(sum([x[1] for x in act_rules]), len(holes))
+
+    def test_abstract_phrases_filter(self):
+        holes = [[(0,1), (0,1)], [(0,6), (0,5)], [(2,3), (4,5)], [(2,6), (1,5)], [(3,6), (1,4)], [(4,5), (2,3)]]
+        extractor = RuleExtractor.RuleExtractor(max_sym_src=2)
+        act_rules = extractor.abstract_phrases(holes, holes)
+        exp_rules = [x for x in RuleExtractor.RuleExtractor(max_sym_src=999).abstract_phrases(holes, holes) if extractor.rule_filter(x[0])]
+        self.assertEqual(act_rules, exp_rules)
+        self.assertEqual(act_rules[2], (([(0,6), (0,5)], [(0,1), (0,1)], [(2,6), (1,5)]), 1.0/11))
+
+    def test_abstract_phrases_norm_kept(self):
+        holes = [[(0,1), (0,1)], [(0,6), (0,5)], [(2,3), (4,5)], [(2,6), (1,5)], [(3,6), (1,4)], [(4,5), (2,3)]]
+        extractor = RuleExtractor.RuleExtractor(max_sym_src=2, norm_kept=True)
+        act_rules = extractor.abstract_phrases(holes, holes)
+        self.assertEqual(len(act_rules), 9)
+        self.assertAlmostEqual(sum([x[1] for x in act_rules]), len(holes))
+
+    def test_iter_hiero_rules(self):
+        words = [self.taro_f, self.taro_e]
+        exp_rules = self.default.create_hiero_rules(words, [self.taro_a])
+        act_rules = self.default.iter_hiero_rules(words, [self.taro_a])
+        self.assertNotIsInstance(act_rules, list)
+        self.assertEqual(list(act_rules), exp_rules)
+
+    def test_src_filter(self):
+        src_filter = SrcFilter.SrcFilter(max_len=2)
+        src_filter.add_sentence(["taro", "to", "mo"])
+        self.assertTrue(src_filter.contains(self.taro_f, 2, 4))
+        self.assertFalse(src_filter.contains(self.taro_f, 2, 5))
+        self.assertFalse(src_filter.contains(self.taro_f, 0, 1))
+        # Only rules with all src terminals in the filter are kept, with the
+        # same counts as without the filter
+        words = [self.taro_f, self.taro_e]
+        extractor = RuleExtractor.RuleExtractor(src_filter=src_filter)
+        exp_rules = [(([(2,3), (4,5)],), 1.0), (([(2,6), (1,5)], [(3,6), (1,4)]), 0.2), (([(4,5), (2,3)],), 1.0)]
+        act_rules = extractor.create_hiero_rules(words, [self.taro_a])
+        self.assertEqual(act_rules, exp_rules)
+
+    def test_rule_renderer(self):
+        words = [self.taro_f, self.taro_e]
+        renderer = RuleRenderer.RuleRenderer(words)
+        for rule, count in self.default.create_hiero_rules(words, [self.taro_a]):
+            self.assertEqual(renderer.create_rule_string(rule, count), self.default.create_rule_string(words, rule, count))
+        exp_phrase = "\"he\" x1:X x0:X \"taro\" @ X"
+        act_phrase = renderer.create_phrase_string(1, (0,5), ((2,4), (1,2)))
+        self.assertEqual(act_phrase, exp_phrase)
+        # Words past the end of a sentence are rendered as an empty string
+        renderer = RuleRenderer.RuleRenderer([["c"], []])
+        self.assertEqual(renderer.create_rule_string((((0,1), (0,1)),), 1.0), '"c" @ X ||| "" @ X ||| 1.000000')
+
+    def test_rule_strings_cache(self):
+        cache = RuleCache.RuleCache()
+        strs = [" ".join(self.taro_f), " ".join(self.taro_e), " ".join(["%d-%d" % x for x in self.taro_a])]
+        exp_rules = self.default.create_rule_strings(strs)
+        self.assertEqual(self.default.create_rule_strings(strs, cache), exp_rules)
+        # Reordering the alignments or spacing gives the same key
+        strs = [strs[0]+"  ", strs[1], " ".join(["%d-%d" % x for x in reversed(self.taro_a)])]
+        self.assertEqual(self.default.create_rule_strings(strs, cache), exp_rules)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_iter_rule_strings(self):
+        strs = [" ".join(self.taro_f), " ".join(self.taro_e), " ".join(["%d-%d" % x for x in self.taro_a])]
+        exp_rules = self.default.create_rule_strings(strs)
+        act_rules = self.default.iter_rule_strings(strs)
+        self.assertNotIsInstance(act_rules, list)
+        self.assertEqual(list(act_rules), exp_rules)
+        # Sentences with more rules than the cache holds are not kept
+        cache = RuleCache.RuleCache(max_sent_rules=len(exp_rules)-1)
+        self.assertEqual(list(self.default.iter_rule_strings(strs, cache)), exp_rules)
+        self.assertEqual(len(cache.entries), 0)
+        cache = RuleCache.RuleCache(max_sent_rules=len(exp_rules))
+        self.assertEqual(list(self.default.iter_rule_strings(strs, cache)), exp_rules)
+        self.assertEqual(list(cache.entries.values()), [exp_rules])
+
+    def test_budgets(self):
+        words = [self.taro_f, self.taro_e]
+        nonnull = self.default.create_nonnull([self.taro_a])
+        holes = self.default.extract_phrases(self.default.create_minimal_srcs(nonnull[0], 6), self.taro_a)
+        num_phrases = len(self.default.add_nulls(words, holes, nonnull))
+        self.assertEqual(self.default.count_nulls(words, holes, nonnull), num_phrases)
+        # Over the rule budget, max_nonterm is lowered
+        exp_rules = RuleExtractor.RuleExtractor(max_nonterm=1).create_hiero_rules(words, [self.taro_a])
+        max_rules = self.default.count_abstract(self.default.add_nulls(words, holes, nonnull), holes, 1)
+        log = io.StringIO()
+        extractor = RuleExtractor.RuleExtractor(max_rules=max_rules, log=log)
+        self.assertEqual(extractor.create_hiero_rules(words, [self.taro_a]), exp_rules)
+        self.assertEqual(extractor.max_nonterm, 2)
+        # Over the phrase budget, nulls are not added or the sentence is skipped
+        extractor = RuleExtractor.RuleExtractor(max_phrases=num_phrases-1, log=log)
+        self.assertEqual(extractor.create_hiero_rules(words, [self.taro_a]), self.default.abstract_phrases(holes, holes))
+        extractor = RuleExtractor.RuleExtractor(max_phrases=num_phrases-1, budget_action="skip", log=log)
+        self.assertEqual(extractor.create_hiero_rules(words, [self.taro_a]), [])
+        self.assertEqual(log.getvalue().count("Line 0:"), 3)
+
+    def test_time_budget(self):
+        words = [self.taro_f, self.taro_e]
+        holes = self.default.extract_phrases(self.default.create_minimal_srcs(set((0,2,3,4,5)), 6), self.taro_a)
+        # The deadline is checked while enumerating, even if no rules are made
+        extractor = RuleExtractor.RuleExtractor(max_sym_src=0)
+        extractor.deadline = time.perf_counter()-1
+        self.assertRaises(RuleExtractor.BudgetExceeded, list, extractor.iter_abstract_phrases(holes, holes))
+        self.assertRaises(RuleExtractor.BudgetExceeded, extractor.count_abstract, holes, holes, 2)
+        # Sentences over the time budget are skipped and reported
+        log = io.StringIO()
+        extractor = RuleExtractor.RuleExtractor(max_time=1e-9, log=log)
+        strs = [" ".join(self.taro_f), " ".join(self.taro_e), " ".join(["%d-%d" % x for x in self.taro_a])]
+        self.assertEqual(extractor.create_rule_strings(strs, lineno=3), [])
+        self.assertEqual(log.getvalue(), "Line 3: over the time budget, skipping\n")
+        self.assertIsNone(extractor.deadline)
+        self.assertRaises(RuleExtractor.BudgetExceeded, extractor.create_hiero_rules, words, [self.taro_a])
+        self.assertIsNone(extractor.deadline)
+
+class TestRuleCache(unittest.TestCase):
+
+    def test_evict(self):
+        cache = RuleCache.RuleCache(max_sents=2, max_rules=3)
+        cache.put("a", ["x"])
+        cache.put("b", ["y"])
+        self.assertEqual(cache.get("a"), ["x"])
+        cache.put("c", ["z"])
+        self.assertEqual(cache.get("b"), None)
+        cache.put("d", ["w", "w"])
+        self.assertEqual(list(cache.entries.keys()), ["c", "d"])
+        self.assertEqual(cache.num_rules, 3)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_max_sent_rules(self):
+        cache = RuleCache.RuleCache(max_sent_rules=2)
+        cache.put("a", ["x", "y"])
+        cache.put("b", ["x", "y", "z"])
+        self.assertEqual(list(cache.entries.keys()), ["a"])
+
+class TestRuleAggregator(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = ['"b" @ X ||| "y" @ X ||| 0.500000', '"a" x0:X @ X ||| x0:X "z" @ X ||| 1.000000',
+                      '"b" @ X ||| "y" @ X ||| 0.250000', '"a" @ X ||| "x" @ X ||| 1.000000']
+        self.exp_items = [('"a" @ X ||| "x" @ X ||| ', 1.0), ('"a" x0:X @ X ||| x0:X "z" @ X ||| ', 1.0), ('"b" @ X ||| "y" @ X ||| ', 0.75)]
+
+    def test_aggregate(self):
+        aggregator = RuleAggregator.RuleAggregator()
+        for rule in self.rules:
+            aggregator.add(rule)
+        self.assertEqual(list(aggregator.items()), self.exp_items)
+
+    def test_aggregate_spill(self):
+        aggregator = RuleAggregator.RuleAggregator(max_mem=0, max_runs=2)
+        for rule in self.rules:
+            aggregator.add(rule)
+        self.assertEqual(len(aggregator.runs), 4)
+        self.assertEqual(list(aggregator.items()), self.exp_items)
+        aggregator.close()
+
+    def test_close_unfinished(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            aggregator = RuleAggregator.RuleAggregator(max_mem=0, tmpdir=tmpdir)
+            for rule in self.rules:
+                aggregator.add(rule)
+            self.assertEqual(len(os.listdir(tmpdir)), 1)
+            aggregator.close()
+            self.assertEqual(os.listdir(tmpdir), [])
+
+    def test_add_run(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "counts.gz")
+            aggregator = RuleAggregator.RuleAggregator()
+            for rule in self.rules[:2]:
+                aggregator.add(rule)
+            with BackgroundIO.open_text(filename, "w") as run_out:
+                aggregator.write(io.StringIO(), run_out)
+            aggregator = RuleAggregator.RuleAggregator(max_mem=0, max_runs=2)
+            for rule in self.rules[2:]:
+                aggregator.add(rule)
+            aggregator.add_run(filename)
+            self.assertEqual(list(aggregator.items()), self.exp_items)
+            aggregator.close()
+            self.assertTrue(os.path.exists(filename))
+
+class TestRuleStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filenames = [os.path.join(self.tmpdir.name, x) for x in ("src.txt", "trg.txt")]
+        self.store_dir = os.path.join(self.tmpdir.name, "store")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    # Append lines to the files, and read the new ones through a store
+    def update(self, lines):
+        for filename, line in zip(self.filenames, lines):
+            with open(filename, "a") as out:
+                out.write(line+"\n")
+        store = RuleStore.RuleStore(self.store_dir)
+        store.check({"a": 1}, self.filenames)
+        act_lines = list(zip(*store.open_files(self.filenames)))
+        store.open_counts().close()
+        store.commit({"a": 1}, self.filenames)
+        return store, act_lines
+
+    def test_update(self):
+        store, act_lines = self.update(["a b", "x y"])
+        self.assertEqual(act_lines, [("a b\n", "x y\n")])
+        store, act_lines = self.update(["c", "z"])
+        self.assertEqual(act_lines, [("c\n", "z\n")])
+        self.assertEqual(store.start_line(), 2)
+        self.assertEqual(sorted(os.listdir(self.store_dir)), ["counts.1.gz", "manifest.json"])
+        with self.assertRaises(Exception):
+            RuleStore.RuleStore(self.store_dir).check({"a": 2}, self.filenames)
+
+class TestRuleScorer(unittest.TestCase):
+
+    def setUp(self):
+        self.scorer = RuleScorer.RuleScorer(2)
+
+    def test_get_words(self):
+        exp_words = ["a", '"', "b"]
+        act_words = self.scorer.get_words('"a" x0:X """ "b" @ X')
+        self.assertEqual(act_words, exp_words)
+
+    def test_lex_prob(self):
+        probs = {"NULL": {"e": 0.1}, "f": {"e": 0.5}, "g": {}}
+        exp_prob = math.log(0.6/3)
+        act_prob = self.scorer.lex_prob(["e"], ["f", "g"], probs)
+        self.assertAlmostEqual(act_prob, exp_prob)
+
+    def test_score(self):
+        items = [('"a" @ X ||| "b" @ X |COL| "c" @ X ||| ', 3.0), ('"a" @ X ||| "b" @ X |COL| "d" @ X ||| ', 1.0),
+                 ('"e" @ X ||| "b" @ X |COL| "d" @ X ||| ', 4.0)]
+        egf_outs = [io.StringIO() for x in range(3)]
+        fge_outs = [io.StringIO() for x in range(3)]
+        self.scorer.score(items, egf_outs, fge_outs)
+        exp_egf1 = ('"a" @ X ||| "c" @ X ||| 1egfp=%s 1p=1 1w=1 1lfreq=%s\n' % (self.scorer.format_value(math.log(0.75)), self.scorer.format_value(math.log(3.0))) +
+                    '"a" @ X ||| "d" @ X ||| 1egfp=%s 1p=1 1w=1 1lfreq=0\n' % self.scorer.format_value(math.log(0.25)) +
+                    '"e" @ X ||| "d" @ X ||| 1egfp=0 1p=1 1w=1 1lfreq=%s\n' % self.scorer.format_value(math.log(4.0)))
+        self.assertEqual(egf_outs[2].getvalue(), exp_egf1)
+        exp_fge0 = ('"a" @ X ||| "b" @ X ||| 0fgep=%s\n' % self.scorer.format_value(math.log(0.5)) +
+                    '"e" @ X ||| "b" @ X ||| 0fgep=%s\n' % self.scorer.format_value(math.log(0.5)))
+        self.assertEqual(fge_outs[1].getvalue(), exp_fge0)
+        self.assertEqual(len(fge_outs[0].getvalue().split("\n")), 4)
+
+    def test_score_spilled(self):
+        rand = random.Random(0)
+        words = ['"%s" @ X' % x for x in "abcde"]
+        items = sorted({"%s ||| %s |COL| %s ||| " % (rand.choice(words), rand.choice(words), rand.choice(words)): float(rand.randint(1, 5)) for x in range(60)}.items())
+        exp_egf, exp_fge = [io.StringIO() for x in range(3)], [io.StringIO() for x in range(3)]
+        self.scorer.score(items, exp_egf, exp_fge)
+        # With no memory every target count is spilled to disk
+        scorer = RuleScorer.RuleScorer(2, max_mem=0)
+        act_egf, act_fge = [io.StringIO() for x in range(3)], [io.StringIO() for x in range(3)]
+        scorer.score(items, act_egf, act_fge)
+        self.assertEqual([x.getvalue() for x in act_egf], [x.getvalue() for x in exp_egf])
+        self.assertEqual([x.getvalue() for x in act_fge], [x.getvalue() for x in exp_fge])
+
+class TestRuleCombiner(unittest.TestCase):
+
+    def setUp(self):
+        self.tables = [
+            ['"a" @ X ||| "b" @ X |COL| "c" @ X ||| egfp=-0.5 p=1 w=2\n', '"a" @ X ||| "b" @ X |COL| "d" @ X ||| egfp=-1.0 p=1 w=2\n', '"e" @ X ||| "b" @ X |COL| "d" @ X ||| egfp=0 p=1 w=2\n'],
+            ['"a" @ X ||| "b" @ X |COL| "c" @ X ||| fgep=-0.1\n', '"a" @ X ||| "b" @ X |COL| "d" @ X ||| fgep=-0.2\n', '"e" @ X ||| "b" @ X |COL| "d" @ X ||| fgep=-0.3\n'],
+            ['"a" @ X ||| "b" @ X ||| 0egfp=0 0p=1 0lfreq=1\n', '"e" @ X ||| "b" @ X ||| 0egfp=0 0p=1 0lfreq=1\n'],
+            ['"a" @ X ||| "b" @ X ||| 0fgep=-0.7\n', '"e" @ X ||| "b" @ X ||| 0fgep=-0.7\n'],
+            ['"a" @ X ||| "c" @ X ||| 1egfp=-0.4\n', '"a" @ X ||| "d" @ X ||| 1egfp=-1.1\n', '"e" @ X ||| "d" @ X ||| 1egfp=0\n'],
+            ['"a" @ X ||| "c" @ X ||| 1fgep=0\n', '"a" @ X ||| "d" @ X ||| 1fgep=-0.6\n', '"e" @ X ||| "d" @ X ||| 1fgep=0\n']]
+
+    def test_combine(self):
+        combiner = RuleCombiner.RuleCombiner()
+        out = io.StringIO()
+        combiner.combine(self.tables, out)
+        exp_out = ('"a" @ X ||| "b" @ X |COL| "c" @ X ||| egfp=-0.5 p=1 fgep=-0.1 0egfp=0 0fgep=-0.7 1egfp=-0.4 1fgep=0\n' +
+                   '"a" @ X ||| "b" @ X |COL| "d" @ X ||| egfp=-1.0 p=1 fgep=-0.2 0egfp=0 0fgep=-0.7 1egfp=-1.1 1fgep=-0.6\n' +
+                   '"e" @ X ||| "b" @ X |COL| "d" @ X ||| egfp=0 p=1 fgep=-0.3 0egfp=0 0fgep=-0.7 1egfp=0 1fgep=0\n')
+        self.assertEqual(out.getvalue(), exp_out)
+
+    def test_combine_limit(self):
+        combiner = RuleCombiner.RuleCombiner(limit=1, limit_type="0egfp")
+        out = io.StringIO()
+        combiner.combine(self.tables, out)
+        act_lines = [x.split(" ||| ")[:2] for x in out.getvalue().split("\n") if x]
+        self.assertEqual(act_lines, [['"a" @ X', '"b" @ X |COL| "c" @ X'], ['"e" @ X', '"b" @ X |COL| "d" @ X']])
+
+class TestRuleTable(unittest.TestCase):
+
+    def setUp(self):
+        self.lines = ['"a" @ X ||| "b" @ X |COL| "c" @ X ||| egfp=-0.5 p=1',
+                      '"a" @ X ||| "b" @ X |COL| "d" "c" @ X ||| egfp=-1.25 p=1',
+                      '"a" x0:X @ X ||| x0:X "b" @ X |COL| x0:X @ X ||| egfp=0',
+                      '"e" @ X ||| "b" @ X |COL| "d" @ X ||| ']
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "table.bin")
+        writer = RuleTable.RuleTableWriter(self.filename)
+        for line in self.lines:
+            writer.add(line+"\n")
+        writer.close()
+        self.table = RuleTable.RuleTable(self.filename)
+
+    def tearDown(self):
+        self.table.close()
+        self.tmpdir.cleanup()
+
+    def test_lookup(self):
+        exp_rules = [('"b" @ X |COL| "c" @ X', [("egfp", -0.5), ("p", 1.0)]), ('"b" @ X |COL| "d" "c" @ X', [("egfp", -1.25), ("p", 1.0)])]
+        self.assertEqual(self.table.lookup('"a" @ X'), exp_rules)
+        self.assertEqual(self.table.lookup('"e" @ X'), [('"b" @ X |COL| "d" @ X', [])])
+        self.assertEqual(self.table.lookup('"c" @ X'), [])
+        self.assertEqual(self.table.lookup('"z" @ X'), [])
+
+    def test_iter_lines(self):
+        self.assertEqual(list(self.table.iter_lines()), self.lines)
+
+    def test_unsorted(self):
+        writer = RuleTable.RuleTableWriter(os.path.join(self.tmpdir.name, "unsorted.bin"))
+        writer.add(self.lines[3])
+        self.assertRaises(Exception, writer.add, self.lines[0])
+        writer.out.close()
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = self.tmpdir.name
+        self.log = io.StringIO()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make_pipeline(self, val):
+        pipeline = Pipeline.Pipeline(os.path.join(self.dir, "stages"), threads=2, log=self.log)
+        a, b, c = [os.path.join(self.dir, x) for x in "abc"]
+        pipeline.add(Pipeline.Stage("a", "echo %s > %s" % (val, a), outputs=[a]))
+        pipeline.add(Pipeline.Stage("b", "echo b > %s" % b, outputs=[b]))
+        pipeline.add(Pipeline.Stage("c", "cat %s %s > %s" % (a, b, c), inputs=[a, b], outputs=[c], deps=["a", "b"]))
+        return pipeline
+
+    def test_run(self):
+        self.make_pipeline("a").run()
+        with open(os.path.join(self.dir, "c")) as c_file:
+            self.assertEqual(c_file.read(), "a\nb\n")
+        # Nothing is re-run, then only the changed stages are
+        pipeline = self.make_pipeline("a")
+        pipeline.run()
+        self.assertEqual([x["status"] for x in pipeline.stats.values()], ["skipped"]*3)
+        pipeline = self.make_pipeline("x")
+        pipeline.run()
+        self.assertEqual(dict([(x, y["status"]) for x, y in pipeline.stats.items()]), {"a": "run", "b": "skipped", "c": "run"})
+
+    def test_fail(self):
+        pipeline = Pipeline.Pipeline(os.path.join(self.dir, "stages"), log=self.log)
+        pipeline.add(Pipeline.Stage("fail", "false | cat", outputs=[]))
+        self.assertRaises(Exception, pipeline.run)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, "stages", "fail.done")))
+
+    def test_stats(self):
+        out = os.path.join(self.dir, "out")
+        def write_out():
+            with open(out, "w") as out_file:
+                out_file.write("x\n")
+        pipeline = Pipeline.Pipeline(os.path.join(self.dir, "stages"), log=self.log)
+        pipeline.add(Pipeline.Stage("cmd", "true"))
+        pipeline.add(Pipeline.Stage("func", write_out, outputs=[out]))
+        pipeline.run()
+        self.assertGreater(pipeline.stats["cmd"]["max_rss_kb"], 0)
+        self.assertIsNone(pipeline.stats["func"]["max_rss_kb"])
+        self.assertIn("Finished stage func in", self.log.getvalue())
+
+class TestDocReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filenames = []
+        for i, text in enumerate(["a\n b \n\nc", "d\n", ""]):
+            self.filenames.append(os.path.join(self.tmpdir.name, "%d.txt" % i))
+            with open(self.filenames[-1], "w") as doc:
+                doc.write(text)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_doc_lines(self):
+        reader = DocReader.DocReader()
+        for filename in self.filenames:
+            with open(filename, "r") as doc:
+                exp = [x.strip() for x in doc.readlines()]
+            act = reader.get(filename)
+            self.assertEqual(len(act), len(exp))
+            for start in range(-2, 5):
+                for end in range(-1, 5):
+                    self.assertEqual(act[start:end], exp[start:end])
+        self.assertEqual(reader.get(self.filenames[0])[-1], "c")
+
+    def test_evict(self):
+        reader = DocReader.DocReader(max_docs=2, threads=2)
+        reader.prefetch(self.filenames[0])
+        reader.prefetch(self.filenames[1])
+        self.assertEqual(reader.get(self.filenames[0])[1], "b")
+        reader.get(self.filenames[2])
+        self.assertEqual(list(reader.docs.keys()), self.filenames[::2])
+        self.assertEqual((reader.hits, reader.misses), (1, 1))
+        reader.close()
+
+class TestCorpusGenerator(unittest.TestCase):
+
+    def test_create_corpus(self):
+        corpus = CorpusGenerator.CorpusGenerator(seed=1, num_trgs=2).create_corpus(20)
+        self.assertEqual(corpus, CorpusGenerator.CorpusGenerator(seed=1, num_trgs=2).create_corpus(20))
+        extractor = RuleExtractor.RuleExtractor(num_trgs=2)
+        for strs in corpus:
+            self.assertEqual(len(strs), 5)
+            words, aligns = extractor.parse_lines(strs)
+            self.assertTrue(5 <= len(words[0]) <= 30)
+            for trg_words, align in zip(words[1:], aligns):
+                for i, j in align:
+                    self.assertTrue(0 <= i < len(words[0]) and 0 <= j < len(trg_words))
+
+class TestExtractStats(unittest.TestCase):
+
+    def test_create_rule_strings(self):
+        corpus = CorpusGenerator.CorpusGenerator(seed=2, max_len=12).create_corpus(10)
+        stats = ExtractStats.ExtractStats(top_k=3)
+        default, timed = RuleExtractor.RuleExtractor(), RuleExtractor.RuleExtractor(stats=stats)
+        cache = RuleCache.RuleCache()
+        for i, strs in enumerate(corpus + corpus[:2]):
+            self.assertEqual(timed.create_rule_strings(strs, cache, i+1), default.create_rule_strings(strs))
+        self.assertEqual(stats.sents, 12)
+        self.assertEqual(stats.counts["cached_sents"], 2)
+        # The rules count includes those from the cache, which are not
+        # enumerated again
+        cached_rules = sum([len(default.create_rule_strings(x)) for x in corpus[:2]])
+        self.assertEqual(stats.counts["rules"], sum([len(default.create_rule_strings(x)) for x in corpus])+cached_rules)
+        self.assertEqual(stats.counts["hole_combinations"], stats.counts["rules"]-cached_rules+stats.counts["filtered_rules"])
+        self.assertEqual(len(stats.slowest), 3)
+
+    def test_merge(self):
+        stats, other = ExtractStats.ExtractStats(top_k=2), ExtractStats.ExtractStats(top_k=2)
+        stats.add_sentence(1, 0.5)
+        other.add_sentence(2, 0.1)
+        other.add_sentence(3, 0.9)
+        other.counts["rules"] = 4
+        stats.merge(other)
+        self.assertEqual(stats.sents, 3)
+        self.assertEqual(stats.counts["rules"], 4)
+        self.assertEqual([x["line"] for x in stats.to_dict()["slowest"]], [3, 1])
+
+class TestBackgroundIO(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_gzip(self):
+        filename = os.path.join(self.tmpdir.name, "out.txt.gz")
+        with BackgroundIO.open_text(filename, "w") as out:
+            writer = BackgroundIO.BackgroundWriter(out, block_size=10)
+            for i in range(100):
+                writer.write("line %d\n" % i)
+            writer.close()
+        with BackgroundIO.open_text(filename) as in_file:
+            act_lines = list(BackgroundIO.BackgroundReader(in_file, chunk_size=7, max_chunks=2))
+        self.assertEqual(act_lines, ["line %d\n" % i for i in range(100)])
+
+    def test_reader_error(self):
+        def items():
+            yield 1
+            raise ValueError("bad input")
+        with self.assertRaises(ValueError):
+            list(BackgroundIO.BackgroundReader(items()))
+
+# extract-groups.py is a script, so load it by its file name
+spec = importlib.util.spec_from_file_location("extract_groups", os.path.join(MULTDIR, "extract-groups.py"))
+extract_groups = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(extract_groups)
+
+class TestMultiExtract(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        generator = CorpusGenerator.CorpusGenerator(seed=4, max_len=10, num_trgs=2)
+        self.filenames = generator.write_corpus(generator.create_corpus(10), os.path.join(self.tmpdir.name, "corpus"))
+        self.serial = self.run_script()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    # Run multi-extract.py on the corpus, returning what it prints
+    def run_script(self, *args):
+        proc = subprocess.run([sys.executable, os.path.join(MULTDIR, "multi-extract.py")] + list(args) + self.filenames, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        return proc.stdout
+
+    def test_workers(self):
+        self.assertTrue(self.serial)
+        self.assertEqual(self.run_script("--workers", "2", "--chunk_size", "3"), self.serial)
+        unordered = self.run_script("--workers", "2", "--chunk_size", "3", "--unordered")
+        self.assertEqual(sorted(unordered.split("\n")), sorted(self.serial.split("\n")))
+
+    def test_aggregate(self):
+        aggregator = RuleAggregator.RuleAggregator()
+        for line in self.serial.split("\n")[:-1]:
+            aggregator.add(line)
+        exp_out = io.StringIO()
+        aggregator.write(exp_out)
+        self.assertEqual(self.run_script("--aggregate"), exp_out.getvalue())
+        self.assertEqual(self.run_script("--aggregate", "--workers", "2", "--chunk_size", "3"), exp_out.getvalue())
+
+    def test_output_gz(self):
+        out_name = os.path.join(self.tmpdir.name, "rules.gz")
+        for args in [[], ["--workers", "2", "--chunk_size", "3"]]:
+            self.assertEqual(self.run_script("--output", out_name, *args), "")
+            with gzip.open(out_name, "rt") as out_file:
+                self.assertEqual(out_file.read(), self.serial)
+
+class TestExtractGroups(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        # Documents b and c of en-fr are in the wrong order in bad.en-fr.xml
+        docs = {"en-fr": [("en/a.xml", "fr/a.xml", ['1;1', '2 3;2', '4;', '5;3 4']),
+                          ("en/b.xml", "fr/b.xml", ['1 2;1', '3;2']),
+                          ("en/c.xml", "fr/c.xml", ['1;1'])],
+                "de-en": [("de/a.xml", "en/a.xml", ['1;1 2', '2;3', '3;4']),
+                          ("de/c.xml", "en/c.xml", ['1 2;1'])]}
+        docs["bad.en-fr"] = [docs["en-fr"][0], docs["en-fr"][2], docs["en-fr"][1]]
+        for name, groups in docs.items():
+            lines = ['<?xml version="1.0" encoding="utf-8"?>', '<cesAlign version="1.0">']
+            for from_doc, to_doc, links in groups:
+                lines.append(' <linkGrp targType="s" toDoc="%s" fromDoc="%s">' % (to_doc, from_doc))
+                lines += ['<link certainty="0.%d" xtargets="%s" />' % (i+5, x) for i, x in enumerate(links)]
+                lines.append(' </linkGrp>')
+            lines.append('</cesAlign>')
+            with open(self.xml(name), "w") as xml_file:
+                xml_file.write("\n".join(lines)+"\n")
+            with gzip.open(self.xml(name)+".gz", "wt") as xml_file:
+                xml_file.write("\n".join(lines)+"\n")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def xml(self, name):
+        return os.path.join(self.tmpdir.name, name+".xml")
+
+    # Run extract-groups.py, returning the documents it prints
+    def run_script(self, *xmlargs):
+        proc = subprocess.run([sys.executable, os.path.join(MULTDIR, "extract-groups.py")] + list(xmlargs), stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        return proc.stdout.split("\n\n")
+
+    # Expand the spans by repeating until nothing changes, as done before
+    def expand_fixpoint(self, links):
+        span_len, next_len = -1, sum([y[1]-y[0] for x, y in links.items()])
+        while next_len != span_len:
+            span_len = next_len
+            for x, y in links.items():
+                my_spans = [links[z] for z in range(y[0], y[1]+1) if z in links]
+                links[x] = (min([z[0] for z in my_spans]), max([z[1] for z in my_spans]))
+            next_len = sum([y[1]-y[0] for x, y in links.items()])
+
+    def test_expand_links(self):
+        rand = random.Random(0)
+        for i in range(500):
+            keys = rand.sample(range(40), rand.randint(0, 30))
+            links = {x: (x-rand.choice([0, 0, 1, 2, 5, 10]), x+rand.choice([0, 0, 1, 2, 5, 10])) for x in keys}
+            exp_links, act_links = dict(links), dict(links)
+            self.expand_fixpoint(exp_links)
+            extract_groups.expand_links(act_links)
+            self.assertEqual(act_links, exp_links)
+
+    def test_expand_links_chain(self):
+        links = {x: (x, x+1) for x in range(10000)}
+        extract_groups.expand_links(links)
+        self.assertEqual(links[0], (0, 10000))
+        self.assertEqual(links[9999], (9999, 10000))
+
+    def test_sorted(self):
+        act = self.run_script(self.xml("en-fr"), self.xml("de-en"))
+        self.assertEqual(act[0], "en/a.xml\nen\tfr\tde\n1-3\t2-2\t2-2 ||| 0.500000\n4-4\t\t3-3 ||| 0.700000\n5-5\t3-4\t ||| 0.800000")
+        self.assertEqual(sorted(act), sorted(self.run_script("--unsorted", self.xml("en-fr"), self.xml("de-en"))))
+
+    def test_workers(self):
+        exp = self.run_script(self.xml("en-fr"), self.xml("de-en"))
+        self.assertEqual(self.run_script("--workers", "2", self.xml("en-fr")+".gz", self.xml("de-en")+".gz"), exp)
+        self.assertEqual(sorted(self.run_script("--unsorted", "--workers", "2", self.xml("en-fr")+".gz", self.xml("de-en")+".gz")), sorted(exp))
+
+    def test_not_sorted(self):
+        for workers in ("1", "2"):
+            proc = subprocess.run([sys.executable, os.path.join(MULTDIR, "extract-groups.py"), "--workers", workers, self.xml("bad.en-fr"), self.xml("de-en")], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            self.assertNotEqual(proc.returncode, 0)
+            self.assertIn("not sorted by name at en/b.xml", proc.stderr)
+
 if __name__ == '__main__':
     unittest.main()
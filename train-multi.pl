@@ -13,11 +13,15 @@ my $THREADS=2;
 my $SRC="en";
 my $LMSIZE="0100000";
 my $TMSIZE="0100000";
+my $NATIVE_SCORE=1;
+my $INCREMENTAL=0;
 GetOptions(
 "lmsize=s" => \$LMSIZE,
 "tmsize=s" => \$TMSIZE,
 "threads=s" => \$THREADS,
 "src=s" => \$SRC,
+"native-score!" => \$NATIVE_SCORE,
+"incremental!" => \$INCREMENTAL,
 );
 
 if(@ARGV == 0) {
@@ -46,24 +50,35 @@ for(@files) { -e $_ or die "Could not find file $_\n"; }
 
 my $ID = "$SRC".join("", @trgs)."-lm".join("x",map { $LMSIZE } @trgs)."-tm$TMSIZE-fstd";
 
-# Create the output directory
-(not -e "multi-model/$ID") or die "multi-model/$ID already exists";
+# Create the output directory. With --incremental an existing model is
+# updated, reusing its extracted counts
+($INCREMENTAL or not -e "multi-model/$ID") or die "multi-model/$ID already exists";
 
 # Perform rule extraction
 safesystem("mkdir -p multi-model/$ID/model") or die;
-safesystem("$MULTDIR/multi-extract.py @files | gzip > multi-model/$ID/model/extract.gz") or die;
-
-# Score the table as a whole with no lexical weighting
-my $cmd1 = "zcat multi-model/$ID/model/extract.gz | env LC_ALL=C sort | $TRAVDIR/script/train/score-t2s.pl --cond-prefix=egf --joint | env LC_ALL=C sort | gzip > multi-model/$ID/model/rule-table.src-trg.all.gz";
-my $cmd2 = "zcat multi-model/$ID/model/extract.gz | $TRAVDIR/script/train/reverse-rt.pl | env LC_ALL=C sort | $TRAVDIR/script/train/score-t2s.pl --cond-prefix=fge | $TRAVDIR/script/train/reverse-rt.pl | env LC_ALL=C sort | gzip > multi-model/$ID/model/rule-table.trg-src.all.gz";
-run_two($cmd1, $cmd2);
-
-# Score each factor of the table with conditional probabilities and lexical
-foreach my $factnum (0 .. $#trgs) {
-    my $trg = $trgs[$factnum];
-    $cmd1 = "zcat multi-model/$ID/model/extract.gz | $MULTDIR/extract-factor.pl $factnum | env LC_ALL=C sort | $TRAVDIR/script/train/score-t2s.pl --lex-prob-file=$standmod[$factnum]/lex/trg_given_src.lex --prefix=$factnum --cond-prefix=egf --joint | env LC_ALL=C sort | gzip > multi-model/$ID/model/rule-table.src-trg.$factnum.gz";
-    $cmd2 = "zcat multi-model/$ID/model/extract.gz | $MULTDIR/extract-factor.pl $factnum | $TRAVDIR/script/train/reverse-rt.pl | env LC_ALL=C sort | $TRAVDIR/script/train/score-t2s.pl --lex-prob-file=$standmod[$factnum]/lex/src_given_trg.lex --prefix=$factnum --cond-prefix=fge | $TRAVDIR/script/train/reverse-rt.pl | env LC_ALL=C sort | gzip > multi-model/$ID/model/rule-table.trg-src.$factnum.gz";
+# With --incremental, keep the counts in a store and only extract the lines
+# added to the corpus since the last run
+my $store = ($INCREMENTAL ? "--store multi-model/$ID/model/extract-store" : "");
+safesystem("$MULTDIR/multi-extract.py --aggregate $store @files | gzip > multi-model/$ID/model/extract.gz") or die;
+
+if($NATIVE_SCORE) {
+    # Score the whole table and each factor in a single pass
+    my $t2s = join(" ", map { "$_/lex/trg_given_src.lex" } @standmod);
+    my $s2t = join(" ", map { "$_/lex/src_given_trg.lex" } @standmod);
+    safesystem("$MULTDIR/score-multi.py --sorted multi-model/$ID/model/extract.gz multi-model/$ID/model/rule-table --trg_given_src $t2s --src_given_trg $s2t") or die;
+} else {
+    # Score the table as a whole with no lexical weighting (extract.gz is already sorted)
+    my $cmd1 = "zcat multi-model/$ID/model/extract.gz | $TRAVDIR/script/train/score-t2s.pl --cond-prefix=egf --joint | env LC_ALL=C sort | gzip > multi-model/$ID/model/rule-table.src-trg.all.gz";
+    my $cmd2 = "zcat multi-model/$ID/model/extract.gz | $TRAVDIR/script/train/reverse-rt.pl | env LC_ALL=C sort | $TRAVDIR/script/train/score-t2s.pl --cond-prefix=fge | $TRAVDIR/script/train/reverse-rt.pl | env LC_ALL=C sort | gzip > multi-model/$ID/model/rule-table.trg-src.all.gz";
     run_two($cmd1, $cmd2);
+
+    # Score each factor of the table with conditional probabilities and lexical
+    foreach my $factnum (0 .. $#trgs) {
+        my $trg = $trgs[$factnum];
+        $cmd1 = "zcat multi-model/$ID/model/extract.gz | $MULTDIR/extract-factor.pl $factnum | env LC_ALL=C sort | $TRAVDIR/script/train/score-t2s.pl --lex-prob-file=$standmod[$factnum]/lex/trg_given_src.lex --prefix=$factnum --cond-prefix=egf --joint | env LC_ALL=C sort | gzip > multi-model/$ID/model/rule-table.src-trg.$factnum.gz";
+        $cmd2 = "zcat multi-model/$ID/model/extract.gz | $MULTDIR/extract-factor.pl $factnum | $TRAVDIR/script/train/reverse-rt.pl | env LC_ALL=C sort | $TRAVDIR/script/train/score-t2s.pl --lex-prob-file=$standmod[$factnum]/lex/src_given_trg.lex --prefix=$factnum --cond-prefix=fge | $TRAVDIR/script/train/reverse-rt.pl | env LC_ALL=C sort | gzip > multi-model/$ID/model/rule-table.trg-src.$factnum.gz";
+        run_two($cmd1, $cmd2);
+    }
 }
 
 # Create the multi-output phrase table
@@ -73,7 +88,7 @@ for my $factnum ("all", 0 .. $#trgs) {
         push @tables, "multi-model/$ID/model/rule-table.$dir.$factnum.gz";
     }
 }
-safesystem("$MULTDIR/combine-multi-rt.pl @tables | gzip > multi-model/$ID/model/rule-table.gz");
+safesystem("$MULTDIR/combine-multi.py @tables | gzip > multi-model/$ID/model/rule-table.gz");
 
 # Create the glue rules
 my $gfile = "$WD/multi-model/$ID/model/glue-rules";
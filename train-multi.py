@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+
+import Pipeline
+
+################### Arguments ###################
+
+# Arguments
+home = os.environ.get("HOME", "")
+parser = argparse.ArgumentParser(description='Train a multi-target model. Completed stages are skipped when re-run.')
+parser.add_argument('trgs', type=str, nargs='+', help='The target languages')
+parser.add_argument('--src', default="en", type=str, help='The source language')
+parser.add_argument('--lmsize', default="0100000", type=str, help='The size of the LM data')
+parser.add_argument('--tmsize', default="0100000", type=str, help='The size of the TM data')
+parser.add_argument('--threads', default=2, type=int, help='The number of stages (and extraction workers) to run at once')
+parser.add_argument('--native_score', default=True, action=argparse.BooleanOptionalAction, help='Score with score-multi.py instead of score-t2s.pl')
+parser.add_argument('--incremental', action='store_true', help='Keep the extracted counts and only extract the lines added to the corpus since the last run')
+parser.add_argument('--multdir', default=home+"/work/multi-extract", type=str, help='The multi-extract directory')
+parser.add_argument('--travdir', default=home+"/work/travatar", type=str, help='The travatar directory')
+args = parser.parse_args()
+
+WD = os.getcwd()
+MULTDIR = args.multdir
+TRAVDIR = args.travdir
+SRC = args.src
+trgs = args.trgs
+
+#################### Inputs ##############################
+
+# Check to make sure the target files and alignments exists
+files = ["tok/train-%s.%s" % (args.tmsize, SRC)]
+standmod = []
+for trg in trgs:
+    files.append("tok/train-%s.%s" % (args.tmsize, trg))
+    standmod.append("standard-model/%s%s-lm%s-tm%s" % (SRC, trg, args.lmsize, args.tmsize))
+    files.append("%s/align/align.txt" % standmod[-1])
+for filename in files:
+    if not os.path.exists(filename):
+        raise Exception("Could not find file %s" % filename)
+
+ID = "%s%s-lm%s-tm%s-fstd" % (SRC, "".join(trgs), "x".join([args.lmsize for x in trgs]), args.tmsize)
+MODEL = "multi-model/%s/model" % ID
+os.makedirs(MODEL, exist_ok=True)
+
+pipeline = Pipeline.Pipeline("%s/.stages" % MODEL, threads=args.threads)
+
+#################### Rule extraction ##############################
+
+extract = "%s/extract.gz" % MODEL
+store = "--store %s/extract-store" % MODEL if args.incremental else ""
+pipeline.add(Pipeline.Stage("extract",
+    "%s/multi-extract.py --aggregate %s --workers %d %s | gzip > %s" % (MULTDIR, store, args.threads, " ".join(files), extract),
+    inputs=files, outputs=[extract]))
+
+#################### Scoring ##############################
+
+names = ["all"] + [str(x) for x in range(len(trgs))]
+tables = []
+for name in names:
+    for direction in ("src-trg", "trg-src"):
+        tables.append("%s/rule-table.%s.%s.gz" % (MODEL, direction, name))
+t2s_lex = ["%s/lex/trg_given_src.lex" % x for x in standmod]
+s2t_lex = ["%s/lex/src_given_trg.lex" % x for x in standmod]
+
+if args.native_score:
+    # Score the whole table and each factor in a single pass
+    pipeline.add(Pipeline.Stage("score",
+        "%s/score-multi.py --sorted %s %s/rule-table --trg_given_src %s --src_given_trg %s" % (MULTDIR, extract, MODEL, " ".join(t2s_lex), " ".join(s2t_lex)),
+        inputs=[extract]+t2s_lex+s2t_lex, outputs=tables, deps=["extract"]))
+    score_stages = ["score"]
+else:
+    # Score the table as a whole with no lexical weighting, and each factor
+    # with conditional probabilities and lexical weighting. These are
+    # independent so they run in parallel
+    score = "%s/script/train/score-t2s.pl" % TRAVDIR
+    reverse = "%s/script/train/reverse-rt.pl" % TRAVDIR
+    score_stages = []
+    for i, name in enumerate(names):
+        if name == "all":
+            factor, st_opts, ts_opts = "", "--cond-prefix=egf --joint", "--cond-prefix=fge"
+        else:
+            factor = " | %s/extract-factor.pl %s" % (MULTDIR, name)
+            st_opts = "--lex-prob-file=%s --prefix=%s --cond-prefix=egf --joint" % (t2s_lex[i-1], name)
+            ts_opts = "--lex-prob-file=%s --prefix=%s --cond-prefix=fge" % (s2t_lex[i-1], name)
+        pipeline.add(Pipeline.Stage("score-src-trg-"+name,
+            "zcat %s%s | env LC_ALL=C sort | %s %s | env LC_ALL=C sort | gzip > %s" % (extract, factor, score, st_opts, tables[2*i]),
+            inputs=[extract]+t2s_lex[i-1:i], outputs=[tables[2*i]], deps=["extract"]))
+        pipeline.add(Pipeline.Stage("score-trg-src-"+name,
+            "zcat %s%s | %s | env LC_ALL=C sort | %s %s | %s | env LC_ALL=C sort | gzip > %s" % (extract, factor, reverse, score, ts_opts, reverse, tables[2*i+1]),
+            inputs=[extract]+s2t_lex[i-1:i], outputs=[tables[2*i+1]], deps=["extract"]))
+        score_stages += ["score-src-trg-"+name, "score-trg-src-"+name]
+
+#################### Combination ##############################
+
+# Create the multi-output phrase table
+rule_table = "%s/rule-table.gz" % MODEL
+pipeline.add(Pipeline.Stage("combine",
+    "%s/combine-multi.py %s | gzip > %s" % (MULTDIR, " ".join(tables), rule_table),
+    inputs=tables, outputs=[rule_table], deps=score_stages))
+
+# Create the glue rules and the config file
+gfile = "%s/%s/glue-rules" % (WD, MODEL)
+tini_file = "%s/%s/travatar.ini" % (WD, MODEL)
+def write_config():
+    with open(gfile, "w") as glue:
+        print("x0:X @ S ||| %s ||| " % " |COL| ".join(["x0:X @ S" for x in trgs]), file=glue)
+        print("x0:S x1:X @ S ||| %s ||| glue=1" % " |COL| ".join(["x0:S x1:X @ S" for x in trgs]), file=glue)
+    tm_files = "%s/%s\n%s" % (WD, rule_table, gfile)
+    lm_files = "\n".join(["%s/lm/%s-lm%s.blm|factor=%d,lm_feat=%dlm,lm_unk_feat=%dlmunk" % (WD, x, args.lmsize, i, i, i) for i, x in enumerate(trgs)])
+    with open(tini_file, "w") as tini:
+        tini.write("[tm_file]\n%s\n\n" % tm_files)
+        tini.write("[lm_file]\n%s\n\n" % lm_files)
+        tini.write("[in_format]\nword\n\n")
+        tini.write("[tm_storage]\nfsm\n\n")
+        tini.write("[search]\ncp\n\n")
+        tini.write("[trg_factors]\n%d\n\n" % len(trgs))
+        tini.write("[hiero_span_limit]\n20\n1000\n\n")
+        # Default values for the weights
+        weights = "0egfp=0.05\n0egfl=0.05\n0fgep=0.05\n0fgel=0.05\n0lm=0.3\n0w=0.3\np=-0.15\nunk=-1\nlfreq=0.05\n"
+        tini.write("[weight_vals]\n%s\n" % weights)
+pipeline.add(Pipeline.Stage("config", write_config, outputs=[gfile, tini_file], deps=["combine"], params=(WD, trgs, args.lmsize)))
+
+################## Main Program ###################
+
+try:
+    pipeline.run()
+finally:
+    pipeline.write_stats("%s/stages.json" % MODEL)
+print("Finished training! You can find the configuation file in:\n%s" % tini_file)